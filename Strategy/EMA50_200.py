@@ -1,11 +1,13 @@
-import os, time, hmac, hashlib, json, requests, random
+import os, time, json, random
 import datetime
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List
 from dotenv import load_dotenv
 
 import pandas as pd
 import pandas_ta as ta
 
+from bitkub_common import make_session, BitkubSigner, json_loads
+
 load_dotenv()
 
 # ------------------------------------------------------------
@@ -67,7 +69,8 @@ COMMON_HEADERS = {
     "Content-Type": "application/json"
 }
 
-session = requests.Session()
+session = make_session()
+
 
 # ------------------------------------------------------------
 # [2] HTTP + BACKOFF
@@ -176,7 +179,7 @@ def sync_server_time():
     url = f"{BASE_URL}/api/servertime"
     try:
         r = http_get(url, timeout=8)
-        data = r.json()
+        data = json_loads(r.content)
         # server time ของ Bitkub v1 จะคืนเป็น int ตรง ๆ หรืออยู่ใน "result"
         if isinstance(data, dict) and "result" in data:
             server_time = int(data["result"])
@@ -202,21 +205,9 @@ def ts_ms_str() -> str:
 # ------------------------------------------------------------
 # [4] AUTH UTILITIES
 # ------------------------------------------------------------
-def sign(timestamp_ms: str, method: str, request_path: str, body: str = "") -> str:
-    payload = (timestamp_ms + method.upper() + request_path + body).encode()
-    return hmac.new(API_SECRET, payload, hashlib.sha256).hexdigest()
-
-
-def build_headers(timestamp_ms: str, signature: Optional[str] = None) -> Dict[str, str]:
-    h = {
-        "Accept": "application/json",
-        "Content-Type": "application/json",
-        "X-BTK-APIKEY": API_KEY,
-        "X-BTK-TIMESTAMP": timestamp_ms,
-    }
-    if signature:
-        h["X-BTK-SIGN"] = signature
-    return h
+_signer = BitkubSigner(API_KEY, API_SECRET)
+sign = _signer.sign
+build_headers = _signer.build_headers
 
 
 # ------------------------------------------------------------
@@ -236,7 +227,7 @@ def place_bid(sym: str, thb_amount: float, rate: float, dry_run: bool) -> Dict[s
         return {"dry_run": True, "endpoint": path, "payload": payload}
     sg = sign(ts, method, path, body)
     r = http_post(BASE_URL + path, headers=build_headers(ts, sg), data=body, timeout=HTTP_TIMEOUT)
-    return r.json()
+    return json_loads(r.content)
 
 
 def place_ask(sym: str, qty_coin: float, rate: float, dry_run: bool) -> Dict[str, Any]:
@@ -253,7 +244,7 @@ def place_ask(sym: str, qty_coin: float, rate: float, dry_run: bool) -> Dict[str
         return {"dry_run": True, "endpoint": path, "payload": payload}
     sg = sign(ts, method, path, body)
     r = http_post(BASE_URL + path, headers=build_headers(ts, sg), data=body, timeout=HTTP_TIMEOUT)
-    return r.json()
+    return json_loads(r.content)
 
 
 # ------------------------------------------------------------
@@ -317,7 +308,7 @@ def fetch_1h_candles(sym: str, lookback_bars: int = 200) -> List[Dict[str, Any]]
     }
 
     r = http_get(url, params=params, timeout=HTTP_TIMEOUT)
-    data = r.json()
+    data = json_loads(r.content)
 
     # ปกติจะเป็น: { "s":"ok", "t":[...], "o":[...], "h":[...], "l":[...], "c":[...], "v":[...] }
     if not isinstance(data, dict) or data.get("s") != "ok":
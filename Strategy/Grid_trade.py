@@ -16,8 +16,6 @@
 
 import os
 import time
-import hmac
-import hashlib
 import json
 import requests
 import random
@@ -29,6 +27,8 @@ from typing import Dict, Any, List, Optional
 
 import numpy as np
 
+from bitkub_common import make_session, BitkubSigner, json_loads
+
 load_dotenv()
 
 # ------------------------------------------------------------
@@ -142,7 +142,8 @@ COMMON_HEADERS = {
     "Content-Type": "application/json",
 }
 
-session = requests.Session()
+session = make_session()
+
 
 # แยก base / quote จาก SYMBOL เช่น USDT_THB -> base=USDT, quote=THB
 BASE_ASSET, QUOTE_ASSET = SYMBOL.split("_", 1)
@@ -239,24 +240,9 @@ def ts_ms_str() -> str:
 # [4] AUTH UTILITIES
 # ------------------------------------------------------------
 
-def sign(timestamp_ms: str, method: str, request_path: str, body: str = "") -> str:
-    """
-    v3 sign = HMAC_SHA256( timestamp + method + requestPath + body )
-    """
-    payload = (timestamp_ms + method.upper() + request_path + (body or "")).encode()
-    return hmac.new(API_SECRET, payload, hashlib.sha256).hexdigest()
-
-
-def build_headers(timestamp_ms: str, signature: Optional[str] = None) -> Dict[str, str]:
-    h = {
-        "Accept": "application/json",
-        "Content-Type": "application/json",
-        "X-BTK-APIKEY": API_KEY,
-        "X-BTK-TIMESTAMP": timestamp_ms,
-    }
-    if signature:
-        h["X-BTK-SIGN"] = signature
-    return h
+_signer = BitkubSigner(API_KEY, API_SECRET)
+sign = _signer.sign
+build_headers = _signer.build_headers
 
 
 # ------------------------------------------------------------
@@ -274,7 +260,7 @@ def get_trades(sym: str, limit: int = 10) -> List[Dict[str, Any]]:
     for i in range(RETRY_MAX):
         try:
             r = http_get(url, params=params, timeout=10)
-            data = r.json()
+            data = json_loads(r.content)
 
             if isinstance(data, dict):
                 err = data.get("error")
@@ -639,7 +625,7 @@ def market_wallet() -> Dict[str, Any]:
     body = "{}"
     sg = sign(ts, method, path, body)
     r = http_post(BASE_URL + path, headers=build_headers(ts, sg), data=body, timeout=HTTP_TIMEOUT)
-    return r.json()
+    return json_loads(r.content)
 
 
 def market_balances() -> Dict[str, Any]:
@@ -648,7 +634,7 @@ def market_balances() -> Dict[str, Any]:
     body = "{}"
     sg = sign(ts, method, path, body)
     r = http_post(BASE_URL + path, headers=build_headers(ts, sg), data=body, timeout=HTTP_TIMEOUT)
-    return r.json()
+    return json_loads(r.content)
 
 
 def get_available(asset: str) -> float:
@@ -695,7 +681,7 @@ def place_bid(sym: str, thb_amount: float, rate: float, dry_run: bool) -> Dict[s
 
     sg = sign(ts, method, path, body)
     r = http_post(BASE_URL + path, headers=build_headers(ts, sg), data=body, timeout=HTTP_TIMEOUT)
-    return r.json()
+    return json_loads(r.content)
 
 
 def place_ask(sym: str, qty_coin: float, rate: float, dry_run: bool) -> Dict[str, Any]:
@@ -715,7 +701,7 @@ def place_ask(sym: str, qty_coin: float, rate: float, dry_run: bool) -> Dict[str
 
     sg = sign(ts, method, path, body)
     r = http_post(BASE_URL + path, headers=build_headers(ts, sg), data=body, timeout=HTTP_TIMEOUT)
-    return r.json()
+    return json_loads(r.content)
 
 
 # ------------------------------------------------------------
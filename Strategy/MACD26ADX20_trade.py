@@ -1,11 +1,13 @@
-import os, time, hmac, hashlib, json, requests, random
+import os, time, json, random
 import datetime
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List
 from dotenv import load_dotenv
 
 import pandas as pd
 import pandas_ta as ta
 
+from bitkub_common import make_session, BitkubSigner, json_loads
+
 load_dotenv()
 
 # ------------------------------------------------------------
@@ -70,7 +72,8 @@ COMMON_HEADERS = {
     "Content-Type": "application/json"
 }
 
-session = requests.Session()
+session = make_session()
+
 
 # ------------------------------------------------------------
 # [2] HTTP + BACKOFF
@@ -181,7 +184,7 @@ def sync_server_time():
     url = f"{BASE_URL}/api/v3/servertime"
     try:
         r = http_get(url, timeout=8)
-        data = r.json()
+        data = json_loads(r.content)
         server_time = None
         if isinstance(data, (int, float, str)):
             server_time = int(data)
@@ -210,21 +213,9 @@ def ts_ms_str() -> str:
 # ------------------------------------------------------------
 # [4] AUTH UTILITIES
 # ------------------------------------------------------------
-def sign(timestamp_ms: str, method: str, request_path: str, body: str = "") -> str:
-    payload = (timestamp_ms + method.upper() + request_path + body).encode()
-    return hmac.new(API_SECRET, payload, hashlib.sha256).hexdigest()
-
-
-def build_headers(timestamp_ms: str, signature: Optional[str] = None) -> Dict[str, str]:
-    h = {
-        "Accept": "application/json",
-        "Content-Type": "application/json",
-        "X-BTK-APIKEY": API_KEY,
-        "X-BTK-TIMESTAMP": timestamp_ms,
-    }
-    if signature:
-        h["X-BTK-SIGN"] = signature
-    return h
+_signer = BitkubSigner(API_KEY, API_SECRET)
+sign = _signer.sign
+build_headers = _signer.build_headers
 
 
 # ------------------------------------------------------------
@@ -244,7 +235,7 @@ def place_bid(sym: str, thb_amount: float, rate: float, dry_run: bool) -> Dict[s
         return {"dry_run": True, "endpoint": path, "payload": payload}
     sg = sign(ts, method, path, body)
     r = http_post(BASE_URL + path, headers=build_headers(ts, sg), data=body, timeout=HTTP_TIMEOUT)
-    return r.json()
+    return json_loads(r.content)
 
 
 def place_ask(sym: str, qty_coin: float, rate: float, dry_run: bool) -> Dict[str, Any]:
@@ -261,7 +252,7 @@ def place_ask(sym: str, qty_coin: float, rate: float, dry_run: bool) -> Dict[str
         return {"dry_run": True, "endpoint": path, "payload": payload}
     sg = sign(ts, method, path, body)
     r = http_post(BASE_URL + path, headers=build_headers(ts, sg), data=body, timeout=HTTP_TIMEOUT)
-    return r.json()
+    return json_loads(r.content)
 
 
 # ------------------------------------------------------------
@@ -273,7 +264,7 @@ def market_wallet() -> Dict[str, Any]:
     body = "{}"
     sg = sign(ts, method, path, body)
     r = http_post(BASE_URL + path, headers=build_headers(ts, sg), data=body, timeout=HTTP_TIMEOUT)
-    return r.json()
+    return json_loads(r.content)
 
 
 def market_balances() -> Dict[str, Any]:
@@ -282,7 +273,7 @@ def market_balances() -> Dict[str, Any]:
     body = "{}"
     sg = sign(ts, method, path, body)
     r = http_post(BASE_URL + path, headers=build_headers(ts, sg), data=body, timeout=HTTP_TIMEOUT)
-    return r.json()
+    return json_loads(r.content)
 
 
 # ------------------------------------------------------------
@@ -297,6 +288,8 @@ def load_pos() -> Dict[str, Any]:
             "qty": 0.0,
             "last_trade_ts": 0,
             "hist_peak": 0.0,
+            "tp_price": 0.0,
+            "sl_price": 0.0,
         }
     try:
         with open(POS_FILE, "r", encoding="utf-8") as f:
@@ -312,6 +305,8 @@ def load_pos() -> Dict[str, Any]:
             "qty": 0.0,
             "last_trade_ts": 0,
             "hist_peak": 0.0,
+            "tp_price": 0.0,
+            "sl_price": 0.0,
         }
 
 
@@ -346,7 +341,7 @@ def fetch_15m_candles(sym: str, lookback_bars: int = 200) -> List[Dict[str, Any]
     }
 
     r = http_get(url, params=params, timeout=HTTP_TIMEOUT)
-    data = r.json()
+    data = json_loads(r.content)
 
     # ปกติจะเป็น: { "s":"ok", "t":[...], "o":[...], "h":[...], "l":[...], "c":[...], "v":[...] }
     if not isinstance(data, dict) or data.get("s") != "ok":
@@ -473,8 +468,12 @@ def check_tp_sl_exit(pos: Dict[str, Any], last_close: float) -> bool:
     if entry <= 0:
         return False
 
-    tp_price = entry * (1 + TP_PCT)
-    sl_price = entry * (1 - SL_PCT)
+    # TP/SL คิดครั้งเดียวตอนเข้าไม้ (entry ไม่เปลี่ยนระหว่างถือ) -> รอบปกติเหลือแค่เทียบ float
+    tp_price = pos.get("tp_price") or 0.0
+    sl_price = pos.get("sl_price") or 0.0
+    if tp_price <= 0 or sl_price <= 0:   # position จากไฟล์เก่าที่ยังไม่มีค่าเก็บไว้
+        tp_price = pos["tp_price"] = entry * (1 + TP_PCT)
+        sl_price = pos["sl_price"] = entry * (1 - SL_PCT)
 
     reason = None
     if last_close >= tp_price:
@@ -502,6 +501,8 @@ def check_tp_sl_exit(pos: Dict[str, Any], last_close: float) -> bool:
     pos["entry_price"] = 0.0
     pos["qty"] = 0.0
     pos["hist_peak"] = 0.0      # <<< NEW: reset hist_peak เมื่อปิดไม้
+    pos["tp_price"] = 0.0
+    pos["sl_price"] = 0.0
     pos["last_trade_ts"] = now_sec
     save_pos(pos)
 
@@ -577,6 +578,8 @@ def decide_and_trade_macd():
                     pos["entry_price"] = 0.0
                     pos["qty"] = 0.0
                     pos["hist_peak"] = 0.0
+                    pos["tp_price"] = 0.0
+                    pos["sl_price"] = 0.0
                     pos["last_trade_ts"] = now_sec
                     save_pos(pos)
                     return
@@ -672,6 +675,8 @@ def decide_and_trade_macd():
         now_sec = now_server_ms() // 1000
         pos["side"] = "LONG"
         pos["entry_price"] = price
+        pos["tp_price"] = price * (1 + TP_PCT)
+        pos["sl_price"] = price * (1 - SL_PCT)
         qty = (thb_amount / price) * (1.0 - FEE_RATE)
         pos["qty"] = qty
         pos["last_trade_ts"] = now_sec
@@ -703,6 +708,8 @@ def decide_and_trade_macd():
         pos["entry_price"] = 0.0
         pos["qty"] = 0.0
         pos["hist_peak"] = 0.0      # <<< NEW: reset hist_peak
+        pos["tp_price"] = 0.0
+        pos["sl_price"] = 0.0
         pos["last_trade_ts"] = now_sec
         save_pos(pos)
         return
@@ -1,27 +1,15 @@
-import os, time, hmac, hashlib, json, requests, random, datetime
+import os, socket, time, json, requests, random, datetime, logging
+from dataclasses import dataclass
 from typing import Dict, Any, Optional
 
 from dotenv import load_dotenv
-import pandas as pd
-import pandas_ta as ta
+from requests.adapters import HTTPAdapter
+import numpy as np
 from pathlib import Path
 
-load_dotenv()
+from bitkub_common import BitkubSigner, make_logger, json_loads
 
-# ------------------------------------------------------------
-# COLOR CONSTANTS (ANSI)
-# ------------------------------------------------------------
-RESET   = "\033[0m"
-BOLD    = "\033[1m"
-DIM     = "\033[2m"
-
-FG_RED     = "\033[31m"
-FG_GREEN   = "\033[32m"
-FG_YELLOW  = "\033[33m"
-FG_BLUE    = "\033[34m"
-FG_MAGENTA = "\033[35m"
-FG_CYAN    = "\033[36m"
-FG_WHITE   = "\033[37m"
+load_dotenv()
 
 # ------------------------------------------------------------
 # [1] CONFIGURATION
@@ -44,12 +32,15 @@ PRICE_ROUND = 2
 QTY_ROUND = 6
 
 TIME_SYNC_INTERVAL = 300     # วินาทีในการ resync server time
+TIME_SYNC_SAMPLES = 5        # จำนวนครั้งที่วัด offset ตอนเริ่ม (ตัดตัวที่ RTT สูงสุด 2 ตัวทิ้ง)
 COOLDOWN_SEC = 300           # วินาที cooldown หลังเทรด (เช่น 300 = 5 นาที)
 
 POS_FILE = "Cost.json"       # ไฟล์เก็บสถานะ position
+IND_STATE_FILE = "IndicatorState.json"   # ไฟล์เก็บ state ของ indicator (ใช้ต่อหลัง restart)
+IND_STATE_MAX_AGE_SEC = 86400            # state เก่ากว่านี้ไม่ใช้ warmup ใหม่ทั้งหมด
 
 # Debug/Networking
-DEBUG_HTTP = True
+DEBUG_HTTP = True            # True = แสดง log [HTTP ...] (ระดับ DEBUG)
 HTTP_TIMEOUT = 12
 RETRY_MAX = 4
 RETRY_BASE_DELAY = 0.6       # seconds
@@ -59,13 +50,28 @@ COMMON_HEADERS = {
     "Content-Type": "application/json"
 }
 
+class _NoDelayAdapter(HTTPAdapter):
+    """
+    HTTPAdapter ที่กำหนด TCP_NODELAY (ปิด Nagle) + SO_KEEPALIVE ให้ทุก connection ใน pool
+    body ของ request ส่วนใหญ่เล็กมาก (<300 B) ไม่ควรโดนหน่วงรอ ACK
+    """
+
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs["socket_options"] = [
+            (socket.IPPROTO_TCP, socket.TCP_NODELAY, 1),
+            (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1),
+        ]
+        super().init_poolmanager(*args, **kwargs)
+
+
 session = requests.Session()
+session.mount("https://", _NoDelayAdapter())
 
 # ------------------------------------------------------------
 # [2] LOGGING + TIME SYNC
 # ------------------------------------------------------------
 _server_offset_ms = 0
-_last_sync_ts = 0
+_next_sync_mono = 0.0      # time.monotonic() ที่ถึงเวลา resync รอบถัดไป
 
 
 def _backoff_sleep(i: int):
@@ -79,14 +85,12 @@ def http_get(url, params=None, timeout=HTTP_TIMEOUT):
     for i in range(RETRY_MAX):
         try:
             r = session.get(url, params=params, headers=COMMON_HEADERS, timeout=timeout)
-            if DEBUG_HTTP:
-                print(f"[HTTP GET] {r.request.method} {r.url} -> {r.status_code}")
+            logger.debug("[HTTP GET] %s %s -> %s", r.request.method, r.url, r.status_code)
             r.raise_for_status()
             return r
         except Exception as e:
             last_exc = e
-            if DEBUG_HTTP:
-                print(f"[HTTP GET ERROR#{i+1}] {url} params={params} err={e}")
+            logger.debug("[HTTP GET ERROR#%d] %s params=%s err=%s", i + 1, url, params, e)
             _backoff_sleep(i)
     raise last_exc
 
@@ -99,15 +103,14 @@ def http_post(url, headers=None, data="{}", timeout=HTTP_TIMEOUT):
     for i in range(RETRY_MAX):
         try:
             r = session.post(url, headers=h, data=data, timeout=timeout)
-            if DEBUG_HTTP:
+            if logger.isEnabledFor(logging.DEBUG):
                 body_dbg = data if len(data) < 300 else data[:300] + "...(+)"
-                print(f"[HTTP POST] {r.request.method} {r.url} -> {r.status_code} body={body_dbg}")
+                logger.debug("[HTTP POST] %s %s -> %s body=%s", r.request.method, r.url, r.status_code, body_dbg)
             r.raise_for_status()
             return r
         except Exception as e:
             last_exc = e
-            if DEBUG_HTTP:
-                print(f"[HTTP POST ERROR#{i+1}] {url} err={e}")
+            logger.debug("[HTTP POST ERROR#%d] %s err=%s", i + 1, url, e)
             _backoff_sleep(i)
     raise last_exc
 
@@ -124,145 +127,110 @@ def ts_hms() -> str:
     return now_server_dt().strftime("%Y-%m-%d %H:%M:%S")
 
 
-def color_for(msg: str) -> str:
+logger = make_logger("bot", logging.DEBUG if DEBUG_HTTP else logging.INFO,
+                     offset_ms=lambda: _server_offset_ms)
+
+
+def log(msg: str, *args):
+    # format แบบ lazy: ส่ง args แยกมา จะ format ก็ต่อเมื่อ log ถูกแสดงจริง
+    logger.info(msg, *args)
+
+
+def sync_server_time(n_samples: int = TIME_SYNC_SAMPLES):
     """
-    เลือกสีตามประเภท log จาก prefix / keyword ในข้อความ
+    วัด offset เวลา server - local n_samples ครั้ง โดยชดเชยครึ่ง RTT
+    (server_time ถูกสร้างตอนประมาณกลางทางของ request) แล้วเฉลี่ยเฉพาะตัวอย่างที่ RTT ต่ำ
+    ตอนเริ่มวัดหลายครั้ง; resync ระหว่างรัน (ใน ts_ms_str) วัดครั้งเดียวพอ ไม่ให้ request ที่ต้อง sign รอนาน
     """
-    # ERROR / EXCEPTION
-    if "ERROR" in msg or "EXC" in msg:
-        return FG_RED + BOLD
-
-    # HTTP DEBUG
-    if msg.startswith("[HTTP GET]") or msg.startswith("[HTTP POST]"):
-        return FG_CYAN + DIM
-    if "[HTTP GET ERROR" in msg or "[HTTP POST ERROR" in msg:
-        return FG_RED
-
-    # SYNC / TIME
-    if msg.startswith("[SYNC"):
-        return FG_CYAN
-
-    # POSITION
-    if msg.startswith("[POS]"):
-        return FG_MAGENTA
-
-    # PRICE / HOLD
-    if msg.startswith("[PRICE]"):
-        return FG_BLUE + BOLD
-    if msg.startswith("[HOLD]"):
-        return FG_CYAN
-
-    # BUY / SELL / COOLDOWN
-    if msg.startswith("[BUY "):
-        return FG_GREEN + BOLD
-    if msg.startswith("[SELL]"):
-        return FG_YELLOW + BOLD
-    if msg.startswith("[COOLDOWN]"):
-        return FG_YELLOW
-
-    # SKIP / WARN
-    if msg.startswith("[SKIP"):
-        return FG_YELLOW
-    if "WARN" in msg:
-        return FG_YELLOW + DIM
-
-    # DEFAULT
-    return FG_WHITE
-
-
-def log(msg: str):
-    ts = ts_hms()
-    color = color_for(msg)
-    out = f"{DIM}[{ts}]{RESET} {color}{msg}{RESET}"
-    print(out)
-
-
-def sync_server_time():
-    global _server_offset_ms, _last_sync_ts
+    global _server_offset_ms, _next_sync_mono
     url = f"{BASE_URL}/api/v3/servertime"
-    try:
-        r = http_get(url, timeout=8)
-        data = r.json()
-        server_time = None
-        if isinstance(data, (int, float, str)):
-            server_time = int(data)
-        elif isinstance(data, dict):
-            server_time = int(data.get("result") or data.get("server_time"))
-        if server_time is None:
-            log(f"[SYNC ERROR] unexpected payload: {data}")
-            return
-        local_time = int(time.time() * 1000)
-        _server_offset_ms = server_time - local_time
-        _last_sync_ts = time.time()
-        readable_time = datetime.datetime.fromtimestamp(server_time / 1000)
-        log(f"[SYNC] offset={_server_offset_ms} ms, server={readable_time:%Y-%m-%d %H:%M:%S}")
-    except Exception as e:
-        log(f"[SYNC ERROR] {e}")
+    samples = []   # (rtt_ms, offset_ms, server_time)
+    for _ in range(n_samples):
+        try:
+            t0 = time.time() * 1000
+            r = http_get(url, timeout=8)
+            t1 = time.time() * 1000
+            data = json_loads(r.content)
+            server_time = None
+            if isinstance(data, (int, float, str)):
+                server_time = int(data)
+            elif isinstance(data, dict):
+                server_time = int(data.get("result") or data.get("server_time"))
+            if server_time is None:
+                log(f"[SYNC ERROR] unexpected payload: {data}")
+                continue
+            rtt = t1 - t0
+            samples.append((rtt, server_time + rtt / 2 - t1, server_time))
+        except Exception as e:
+            log(f"[SYNC ERROR] {e}")
+
+    if not samples:
+        return
+
+    # แบบ NTP: ตัดตัวอย่างที่ RTT สูง (jitter เยอะ) ทิ้ง แล้วเฉลี่ยที่เหลือ
+    samples.sort(key=lambda x: x[0])
+    best = samples[:max(1, len(samples) - 2)]
+    _server_offset_ms = int(sum(x[1] for x in best) / len(best))
+    _next_sync_mono = time.monotonic() + TIME_SYNC_INTERVAL
+    readable_time = datetime.datetime.fromtimestamp(best[0][2] / 1000)
+    log(
+        f"[SYNC] offset={_server_offset_ms} ms, rtt={best[0][0]:.0f} ms, "
+        f"server={readable_time:%Y-%m-%d %H:%M:%S}"
+    )
 
 
 def ts_ms_str() -> str:
-    global _last_sync_ts
-    now = time.time()
-    if now - _last_sync_ts > TIME_SYNC_INTERVAL:
-        sync_server_time()
-    return str(int(now * 1000) + _server_offset_ms)
+    # เช็กรอบ resync ด้วย monotonic clock (ไม่โดนผลจากการปรับนาฬิกาเครื่อง)
+    if time.monotonic() > _next_sync_mono:
+        sync_server_time(1)
+    return str(int(time.time() * 1000) + _server_offset_ms)
 
 
 # ------------------------------------------------------------
 # [3] AUTH UTILITIES
 # ------------------------------------------------------------
-def sign(timestamp_ms: str, method: str, request_path: str, body: str = "") -> str:
-    payload = (timestamp_ms + method.upper() + request_path + body).encode()
-    return hmac.new(API_SECRET, payload, hashlib.sha256).hexdigest()
-
-
-def build_headers(timestamp_ms: str, signature: Optional[str] = None) -> Dict[str, str]:
-    h = {
-        "Accept": "application/json",
-        "Content-Type": "application/json",
-        "X-BTK-APIKEY": API_KEY,
-        "X-BTK-TIMESTAMP": timestamp_ms,
-    }
-    if signature:
-        h["X-BTK-SIGN"] = signature
-    return h
+_signer = BitkubSigner(API_KEY, API_SECRET)
+sign = _signer.sign
+build_headers = _signer.build_headers
 
 
 # ------------------------------------------------------------
 # [4] PRIVATE TRADE API
 # ------------------------------------------------------------
+# body ของ order มี key/ชนิดข้อมูลตายตัว -> ใช้ template สำเร็จรูปแทน dict + json.dumps
+# (PRICE_ROUND / QTY_ROUND ถูกแทนลงไปตั้งแต่ตอน import)
+_BID_TMPL = '{"sym":"%%s","amt":%%.0f,"rat":%%.%df,"typ":"limit"}' % PRICE_ROUND
+_ASK_TMPL = '{"sym":"%%s","amt":%%.%df,"rat":%%.%df,"typ":"limit"}' % (QTY_ROUND, PRICE_ROUND)
+
+
 def place_bid(sym: str, thb_amount: float, rate: float, dry_run: bool) -> Dict[str, Any]:
     method, path = "POST", "/api/v3/market/place-bid"
     ts = ts_ms_str()
-    payload = {
-        "sym": sym,
-        "amt": float(int(thb_amount)),  # ถ้า Bitkub รองรับทศนิยม ค่อยเปลี่ยน logic ตรงนี้
-        "rat": float(round(rate, PRICE_ROUND)),
-        "typ": "limit",
-    }
-    body = json.dumps(payload, separators=(",", ":"))
+    amt = float(int(thb_amount))  # ถ้า Bitkub รองรับทศนิยม ค่อยเปลี่ยน logic ตรงนี้
     if dry_run:
+        payload = {"sym": sym, "amt": amt, "rat": float(round(rate, PRICE_ROUND)), "typ": "limit"}
         return {"dry_run": True, "endpoint": path, "payload": payload}
+    body = _BID_TMPL % (sym, amt, rate)
     sg = sign(ts, method, path, body)
     r = http_post(BASE_URL + path, headers=build_headers(ts, sg), data=body, timeout=HTTP_TIMEOUT)
-    return r.json()
+    return json_loads(r.content)
 
 
 def place_ask(sym: str, qty_coin: float, rate: float, dry_run: bool) -> Dict[str, Any]:
     method, path = "POST", "/api/v3/market/place-ask"
     ts = ts_ms_str()
-    payload = {
-        "sym": sym,
-        "amt": float(round(qty_coin, QTY_ROUND)),
-        "rat": float(round(rate, PRICE_ROUND)),
-        "typ": "limit",
-    }
-    body = json.dumps(payload, separators=(",", ":"))
     if dry_run:
+        payload = {
+            "sym": sym,
+            "amt": float(round(qty_coin, QTY_ROUND)),
+            "rat": float(round(rate, PRICE_ROUND)),
+            "typ": "limit",
+        }
         return {"dry_run": True, "endpoint": path, "payload": payload}
+    body = _ASK_TMPL % (sym, qty_coin, rate)
     sg = sign(ts, method, path, body)
     r = http_post(BASE_URL + path, headers=build_headers(ts, sg), data=body, timeout=HTTP_TIMEOUT)
-    return r.json()
+    return json_loads(r.content)
 
 
 def market_balances() -> Dict[str, Any]:
@@ -271,7 +239,7 @@ def market_balances() -> Dict[str, Any]:
     body = "{}"
     sg = sign(ts, method, path, body)
     r = http_post(BASE_URL + path, headers=build_headers(ts, sg), data=body, timeout=HTTP_TIMEOUT)
-    return r.json()
+    return json_loads(r.content)
 
 
 # ------------------------------------------------------------
@@ -281,6 +249,9 @@ def market_balances() -> Dict[str, Any]:
 RESOLUTION = "5"          # "240" = 4H, "60" = 1H, "15" = 15m
 CANDLE_LIMIT = 300         # จำนวนแท่งเทียนย้อนหลังสำหรับคำนวณอินดิเคเตอร์
 
+CANDLE_CLOSE_GRACE_SEC = 2     # รอหลังขอบแท่งกี่วินาทีค่อยดึง (ให้ server ปิดแท่งก่อน)
+NO_NEW_CANDLE_RETRY_SEC = 15   # ถ้ายังไม่มีแท่งใหม่ ลองใหม่เร็ว ๆ แทนการรอ REFRESH_SEC เต็ม
+
 RSI_LENGTH = 14
 RSI_OVERSOLD = 30
 RSI_OVERBOUGHT = 70
@@ -294,91 +265,324 @@ ENABLE_SHORT = False       # Bitkub ไม่มี short margin ตรงๆ ->
 # ------------------------------------------------------------
 # [6] CANDLE FETCHING - TradingView API ของ Bitkub
 # ------------------------------------------------------------
-def fetch_candles(symbol: str, resolution: str, limit: int = 300) -> pd.DataFrame:
+@dataclass
+class Candles:
+    """
+    แท่งเทียนแบบ array แยกคอลัมน์ (เรียงตาม ts จากเก่า -> ใหม่)
+    """
+    ts: np.ndarray   # int64 (วินาที)
+    o: np.ndarray    # float64
+    h: np.ndarray
+    l: np.ndarray
+    c: np.ndarray
+    v: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.ts)
+
+
+EMPTY_CANDLES = Candles(
+    np.empty(0, dtype=np.int64), np.empty(0), np.empty(0), np.empty(0), np.empty(0), np.empty(0)
+)
+
+CANDLE_BUF_SLACK = 16      # ที่ว่างเผื่อท้าย buffer ก่อนต้องเลื่อนข้อมูล
+
+# buffer แท่งเทียนต่อ (symbol, resolution) จองครั้งเดียวแล้วเขียนทับ/ต่อท้ายทุกรอบ
+# Candles ที่ fetch_candles คืนเป็น view ของ buffer นี้ -> ใช้ได้จนกว่าจะเรียก fetch_candles ครั้งถัดไป
+_CANDLE_BUF: Dict[tuple, Dict[str, Any]] = {}
+_CANDLE_FIELDS = ("ts", "o", "h", "l", "c", "v")
+
+
+def _candle_buf(key: tuple, limit: int) -> Dict[str, Any]:
+    buf = _CANDLE_BUF.get(key)
+    size = limit + CANDLE_BUF_SLACK
+    if buf is None or len(buf["ts"]) < size:
+        buf = {"n": 0, "ts": np.empty(size, dtype=np.int64)}
+        for f in _CANDLE_FIELDS[1:]:
+            buf[f] = np.empty(size, dtype=np.float64)
+        _CANDLE_BUF[key] = buf
+    return buf
+
+
+def fetch_candles(symbol: str, resolution: str, limit: int = 300, since_ts: Optional[int] = None) -> Candles:
     """
     ดึงแท่งเทียนจาก Bitkub TradingView API
-    return: DataFrame index เป็น datetime, column: [ts, open, high, low, close, volume]
+    ถ้ามีข้อมูลใน buffer ของรอบก่อน จะขอเฉพาะช่วงตั้งแต่แท่งล่าสุดที่มี (แท่งนั้นอาจยังไม่ปิด) แล้วเขียนต่อท้าย
+    since_ts: ถ้า buffer ยังว่าง ขอเฉพาะตั้งแต่แท่งนี้ (ใช้ตอน restart ที่มี indicator state อยู่แล้ว)
+    return: Candles (ts, o, h, l, c, v) เป็นสำเนา (buffer ถูกเขียนทับรอบถัดไป) หรือ EMPTY_CANDLES ถ้า error
     """
     now_sec = now_server_ms() // 1000
     tf_sec = int(resolution) * 60
     need_sec = (limit + 5) * tf_sec   # ขอเผื่อ 5 แท่ง
+    buf = _candle_buf((symbol, resolution), limit)
+    n = buf["n"]
+    if n and now_sec - int(buf["ts"][n - 1]) > limit * tf_sec:
+        # หลุดไปนานเกินช่วงของ buffer -> ข้อมูลเก่าต่อกับของใหม่ไม่ได้ (จะมีช่องว่างกลาง series) เริ่มใหม่
+        log(f"[WARN] candle gap > {limit} bars, reset buffer {symbol} {resolution}")
+        n = buf["n"] = 0
+
+    from_sec = now_sec - need_sec
+    if n:
+        from_sec = max(from_sec, int(buf["ts"][n - 1]) - tf_sec)
+    elif since_ts is not None:
+        from_sec = max(from_sec, since_ts - tf_sec)
+
     params = {
         "symbol": symbol,
         "resolution": resolution,
-        "from": now_sec - need_sec,
+        "from": from_sec,
         "to": now_sec
     }
     url = f"{BASE_URL}/tradingview/history"
 
     try:
         r = http_get(url, params=params, timeout=HTTP_TIMEOUT)
-        data = r.json()
+        data = json_loads(r.content)
     except Exception as e:
         log(f"[ERROR] fetch_candles http error: {e}")
-        return pd.DataFrame()
+        return EMPTY_CANDLES
 
     if not isinstance(data, dict) or data.get("s") != "ok":
         log(f"[ERROR] fetch_candles bad payload: {data}")
-        return pd.DataFrame()
+        return EMPTY_CANDLES
 
     t = data.get("t") or []
-    o = data.get("o") or []
-    h = data.get("h") or []
-    l = data.get("l") or []
     c = data.get("c") or []
-    v = data.get("v") or []
 
     if not t or not c:
         log("[ERROR] fetch_candles no candles returned")
-        return pd.DataFrame()
+        return EMPTY_CANDLES
 
-    df = pd.DataFrame({
+    cols = {
         "ts": t,
-        "open": o,
-        "high": h,
-        "low": l,
-        "close": c,
-        "volume": v
-    })
-
-    df["dt"] = pd.to_datetime(df["ts"], unit="s")
-    df.set_index("dt", inplace=True)
-    df = df.sort_index()
+        "o": data.get("o") or [],
+        "h": data.get("h") or [],
+        "l": data.get("l") or [],
+        "c": c,
+        "v": data.get("v") or [],
+    }
+    m = len(t)
+
+    # ปกติ API ส่งมาเรียงแล้ว เผื่อไม่เรียงค่อย sort
+    if any(t[i] > t[i + 1] for i in range(m - 1)):
+        order = sorted(range(m), key=t.__getitem__)
+        cols = {f: [vals[i] for i in order] for f, vals in cols.items()}
+
+    # ตำแหน่งที่จะเขียนแท่งใหม่: แท่งเดิมที่ ts ซ้ำหรือใหม่กว่าจะถูกเขียนทับ
+    start = int(np.searchsorted(buf["ts"][:n], cols["ts"][0], side="left"))
+    if m > limit:
+        # ข้อมูลใหม่ยาวเกิน limit เอาเฉพาะท้าย
+        cols = {f: vals[-limit:] for f, vals in cols.items()}
+        m, start = limit, 0
+    elif start + m > len(buf["ts"]):
+        # buffer เต็ม เลื่อนข้อมูลเก่าไปต้น buffer ให้เหลือพอดี limit แท่ง
+        shift = start + m - limit
+        for f in _CANDLE_FIELDS:
+            buf[f][:start - shift] = buf[f][shift:start]
+        start -= shift
+
+    for f in _CANDLE_FIELDS:
+        buf[f][start:start + m] = cols[f]
+    n = buf["n"] = start + m
 
     # ตัดให้เหลือ limit แท่งล่าสุด
-    if len(df) > limit:
-        df = df.iloc[-limit:]
-
-    return df
+    lo = max(0, n - limit)
+    return Candles(*(buf[f][lo:n].copy() for f in _CANDLE_FIELDS))
 
 
 # ------------------------------------------------------------
 # [7] INDICATORS + SIGNAL LOGIC
 # ------------------------------------------------------------
-def add_indicators(df: pd.DataFrame) -> pd.DataFrame:
+# state ของ indicator ต่อ symbol (Wilder smoothing) -> แท่งใหม่อัปเดตแบบ O(1)
+# เก็บเฉพาะแท่งที่ "ปิดแล้ว" แท่งล่าสุด (อาจยังไม่ปิด) คำนวณชั่วคราวทุกรอบ
+_IND_STATE: Dict[str, Dict[str, Any]] = {}
+
+
+def _new_ind_state() -> Dict[str, Any]:
+    nan = float("nan")
+    return {
+        "last_ts": -1,
+        "n": 0,                 # จำนวนแท่งที่ผ่านเข้ามาแล้ว
+        "prev_close": nan,
+        "prev_high": nan,
+        "prev_low": nan,
+        "rsi_avg_gain": 0.0,
+        "rsi_avg_loss": 0.0,
+        "atr": 0.0,
+        "plus_dm_avg": 0.0,
+        "minus_dm_avg": 0.0,
+        "adx": nan,
+        "adx_sum": 0.0,         # ใช้ตอน seed ADX (ค่าเฉลี่ยของ DX ช่วงแรก)
+        "rsi": nan,
+        "plus_di": nan,
+        "minus_di": nan,
+    }
+
+
+def _wilder_step(st: Dict[str, Any], high: float, low: float, close: float) -> Dict[str, Any]:
     """
-    เติม RSI, ADX, +DI, -DI ลงใน DataFrame
+    อัปเดต RSI / ATR / +DI / -DI / ADX ด้วยแท่งใหม่ 1 แท่ง ตามสูตร Wilder
+    ช่วงแรก seed ด้วยค่าเฉลี่ยธรรมดา (SMA) แล้วค่อยใช้ avg = (avg*(n-1) + x) / n
+    return: state ใหม่ (ไม่แก้ของเดิม)
     """
-    if df.empty:
-        return df
+    s = dict(st)
+    i = s["n"]
+    s["n"] = i + 1
+
+    if i == 0:
+        s["prev_close"], s["prev_high"], s["prev_low"] = close, high, low
+        return s
+
+    # ---------- RSI ----------
+    n_rsi = RSI_LENGTH
+    change = close - s["prev_close"]
+    gain = change if change > 0 else 0.0
+    loss = -change if change < 0 else 0.0
+    if i <= n_rsi:
+        s["rsi_avg_gain"] += gain / n_rsi
+        s["rsi_avg_loss"] += loss / n_rsi
+    else:
+        s["rsi_avg_gain"] = (s["rsi_avg_gain"] * (n_rsi - 1) + gain) / n_rsi
+        s["rsi_avg_loss"] = (s["rsi_avg_loss"] * (n_rsi - 1) + loss) / n_rsi
+    if i >= n_rsi:
+        if s["rsi_avg_loss"] == 0:
+            s["rsi"] = 100.0
+        else:
+            s["rsi"] = 100.0 - 100.0 / (1.0 + s["rsi_avg_gain"] / s["rsi_avg_loss"])
+
+    # ---------- ATR / DM ----------
+    n_adx = ADX_LENGTH
+    tr = max(high - low, abs(high - s["prev_close"]), abs(low - s["prev_close"]))
+    up_move = high - s["prev_high"]
+    down_move = s["prev_low"] - low
+    plus_dm = up_move if (up_move > down_move and up_move > 0) else 0.0
+    minus_dm = down_move if (down_move > up_move and down_move > 0) else 0.0
+    if i <= n_adx:
+        s["atr"] += tr / n_adx
+        s["plus_dm_avg"] += plus_dm / n_adx
+        s["minus_dm_avg"] += minus_dm / n_adx
+    else:
+        s["atr"] = (s["atr"] * (n_adx - 1) + tr) / n_adx
+        s["plus_dm_avg"] = (s["plus_dm_avg"] * (n_adx - 1) + plus_dm) / n_adx
+        s["minus_dm_avg"] = (s["minus_dm_avg"] * (n_adx - 1) + minus_dm) / n_adx
+
+    # ---------- +DI / -DI / ADX ----------
+    if i >= n_adx and s["atr"] > 0:
+        s["plus_di"] = 100.0 * s["plus_dm_avg"] / s["atr"]
+        s["minus_di"] = 100.0 * s["minus_dm_avg"] / s["atr"]
+        di_sum = s["plus_di"] + s["minus_di"]
+        dx = 100.0 * abs(s["plus_di"] - s["minus_di"]) / di_sum if di_sum > 0 else 0.0
+
+        j = i - n_adx + 1     # ลำดับของ DX (เริ่มที่ 1)
+        if j < n_adx:
+            s["adx_sum"] += dx
+        elif j == n_adx:
+            s["adx"] = (s["adx_sum"] + dx) / n_adx
+        else:
+            s["adx"] = (s["adx"] * (n_adx - 1) + dx) / n_adx
+
+    s["prev_close"], s["prev_high"], s["prev_low"] = close, high, low
+    return s
+
+
+def update_indicators(symbol: str, candles: Candles) -> Dict[str, Any]:
+    """
+    อัปเดต RSI, ADX, +DI, -DI จากแท่งเทียนล่าสุด
+    - รอบแรก (หรือ state หลุดช่วงข้อมูล) warmup จากทุกแท่งใน candles
+    - รอบถัดไปอัปเดตเฉพาะแท่งใหม่ที่ปิดแล้ว + แท่งล่าสุดแบบชั่วคราว
+    return: dict {close, rsi, rsi_prev, adx, plus_di, minus_di, bars}
+    """
+    if len(candles) == 0:
+        return {}
+
+    ts = candles.ts
+    st = _IND_STATE.get(symbol)
+    if st is None or st["last_ts"] < int(ts[0]) or st["last_ts"] >= int(ts[-1]):
+        st = _new_ind_state()
+
+    start = int(np.searchsorted(ts, st["last_ts"], side="right"))
+    highs = candles.h[start:].tolist()
+    lows = candles.l[start:].tolist()
+    closes = candles.c[start:].tolist()
+    new_ts = ts[start:].tolist()
+
+    # แท่งที่ปิดแล้ว -> commit ลง state
+    for k in range(len(new_ts) - 1):
+        st = _wilder_step(st, highs[k], lows[k], closes[k])
+        st["last_ts"] = new_ts[k]
+    _IND_STATE[symbol] = st
+    if len(new_ts) > 1:
+        save_ind_state(symbol)
+
+    # แท่งล่าสุด -> คำนวณชั่วคราว ไม่ commit
+    now = _wilder_step(st, highs[-1], lows[-1], closes[-1])
+    return {
+        "close": closes[-1],
+        "rsi": now["rsi"],
+        "rsi_prev": st["rsi"],
+        "adx": now["adx"],
+        "plus_di": now["plus_di"],
+        "minus_di": now["minus_di"],
+        "bars": now["n"],
+    }
+
+
+def save_ind_state(symbol: str):
+    """
+    เขียน state ของ indicator ลง IND_STATE_FILE แบบ atomic
+    """
+    data = {
+        "symbol": symbol,
+        "resolution": RESOLUTION,
+        "rsi_length": RSI_LENGTH,
+        "adx_length": ADX_LENGTH,
+        # ค่าที่ยังคำนวณไม่ได้ (NaN) เก็บเป็น null -> ไฟล์เป็น JSON มาตรฐาน parser อื่นอ่านได้
+        "state": {k: (None if v != v else v) for k, v in _IND_STATE[symbol].items()},
+    }
+    try:
+        tmp = IND_STATE_FILE + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, allow_nan=False)
+        os.replace(tmp, IND_STATE_FILE)
+    except Exception as e:
+        log(f"[ERROR] save_ind_state: {e}")
+
 
-    close = df["close"].astype(float)
-    high  = df["high"].astype(float)
-    low   = df["low"].astype(float)
+def load_ind_state(symbol: str) -> Optional[int]:
+    """
+    โหลด state ของ indicator ที่บันทึกไว้ (ถ้า symbol/TF/ค่าความยาวตรงกัน และไม่เก่าเกิน IND_STATE_MAX_AGE_SEC)
+    return: last_ts ของ state ที่โหลดได้ หรือ None
+    """
+    p = Path(IND_STATE_FILE)
+    if not p.exists():
+        return None
+    try:
+        with p.open("r", encoding="utf-8") as f:
+            data = json.load(f)
+    except Exception as e:
+        log(f"[ERROR] load_ind_state: {e}")
+        return None
 
-    # RSI
-    df["rsi"] = ta.rsi(close, length=RSI_LENGTH)
+    if (
+        data.get("symbol") != symbol
+        or data.get("resolution") != RESOLUTION
+        or data.get("rsi_length") != RSI_LENGTH
+        or data.get("adx_length") != ADX_LENGTH
+    ):
+        return None
 
-    # ADX + DI
-    adx_df = ta.adx(high=high, low=low, close=close, length=ADX_LENGTH)
-    df["adx"]      = adx_df[f"ADX_{ADX_LENGTH}"]
-    df["plus_di"]  = adx_df[f"DMP_{ADX_LENGTH}"]   # +DI
-    df["minus_di"] = adx_df[f"DMN_{ADX_LENGTH}"]   # -DI
+    st = data.get("state") or {}
+    if set(st) != set(_new_ind_state()):
+        return None
+    last_ts = int(st["last_ts"])
+    if now_server_ms() // 1000 - last_ts > IND_STATE_MAX_AGE_SEC:
+        return None
 
-    return df
+    _IND_STATE[symbol] = {k: (float("nan") if v is None else v) for k, v in st.items()}
+    return last_ts
 
 
-def detect_signal(df: pd.DataFrame, in_long: bool, in_short: bool) -> Dict[str, Any]:
+def detect_signal(ind: Dict[str, Any], in_long: bool, in_short: bool) -> Dict[str, Any]:
     """
     Strategy: RSI + ADX
 
@@ -400,22 +604,19 @@ def detect_signal(df: pd.DataFrame, in_long: bool, in_short: bool) -> Dict[str,
          - หรือ -DI_now > +DI_now (แรงขายกลับมาชนะ)
          - หรือ ADX_now ลดต่ำกว่า ADX_TREND_THRESHOLD * 0.8 (เทรนด์เริ่มอ่อน)
     """
-    if df.empty or len(df) < ADX_LENGTH + 5:
+    if not ind or ind["bars"] < ADX_LENGTH + 5:
         return {"signal": "NONE", "reason": "WARMUP"}
 
-    last = df.iloc[-1]
-    prev = df.iloc[-2]
-
     # ดึงค่า indicator ล่าสุด
-    price_now      = float(last["close"])
-    rsi_now        = float(last["rsi"])
-    rsi_prev       = float(prev["rsi"])
-    adx_now        = float(last["adx"])
-    plus_di_now    = float(last["plus_di"])
-    minus_di_now   = float(last["minus_di"])
+    price_now      = float(ind["close"])
+    rsi_now        = float(ind["rsi"])
+    rsi_prev       = float(ind["rsi_prev"])
+    adx_now        = float(ind["adx"])
+    plus_di_now    = float(ind["plus_di"])
+    minus_di_now   = float(ind["minus_di"])
 
     # ถ้ายังมี NaN อยู่ แปลว่ายัง warmup indicator ไม่ครบ
-    if any(pd.isna([price_now, rsi_now, rsi_prev, adx_now, plus_di_now, minus_di_now])):
+    if any(v != v for v in (price_now, rsi_now, rsi_prev, adx_now, plus_di_now, minus_di_now)):
         return {"signal": "NONE", "reason": "INDICATOR_NAN"}
 
     strong_trend = adx_now > ADX_TREND_THRESHOLD
@@ -462,7 +663,19 @@ def detect_signal(df: pd.DataFrame, in_long: bool, in_short: bool) -> Dict[str,
 # ------------------------------------------------------------
 # [8] POSITION MANAGEMENT (ใช้ไฟล์ POS_FILE)
 # ------------------------------------------------------------
+_POS_CACHE: Optional[tuple] = None        # (stat key, data) ของ POS_FILE ที่อ่านล่าสุด
+_LAST_POS_SNAPSHOT: Optional[str] = None  # position ที่เขียนลงไฟล์ล่าสุด (ไม่รวม updated)
+
+
+def _pos_snapshot(pos: Dict[str, Any]) -> str:
+    return json.dumps({k: v for k, v in pos.items() if k != "updated"}, sort_keys=True)
+
+
 def load_position() -> Dict[str, Any]:
+    """
+    อ่าน position จาก POS_FILE (ถ้าไฟล์ไม่เปลี่ยนตั้งแต่อ่านครั้งก่อน ใช้ค่าที่ cache ไว้)
+    """
+    global _POS_CACHE
     p = Path(POS_FILE)
     if not p.exists():
         return {
@@ -473,9 +686,13 @@ def load_position() -> Dict[str, Any]:
             "updated": None
         }
     try:
-        with p.open("r", encoding="utf-8") as f:
-            data = json.load(f)
-        return data
+        st = p.stat()
+        stat_key = (st.st_mtime_ns, st.st_size, st.st_ino)
+        if _POS_CACHE is None or _POS_CACHE[0] != stat_key:
+            with p.open("r", encoding="utf-8") as f:
+                _POS_CACHE = (stat_key, json.load(f))
+        # คืน copy เพราะผู้เรียกจะแก้ค่าใน dict ก่อน save_position
+        return dict(_POS_CACHE[1])
     except Exception as e:
         log(f"[POS ERROR] load_position: {e}")
         return {
@@ -488,10 +705,21 @@ def load_position() -> Dict[str, Any]:
 
 
 def save_position(pos: Dict[str, Any]):
+    """
+    เขียน position ลง POS_FILE แบบ atomic (เขียนไฟล์ .tmp แล้ว os.replace)
+    ถ้า position ไม่เปลี่ยนจากที่เขียนไว้ล่าสุดจะข้ามการเขียน
+    """
+    global _LAST_POS_SNAPSHOT
     try:
+        snapshot = _pos_snapshot(pos)
+        if snapshot == _LAST_POS_SNAPSHOT:
+            return
         pos["updated"] = ts_hms()
-        with open(POS_FILE, "w", encoding="utf-8") as f:
+        tmp = POS_FILE + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
             json.dump(pos, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, POS_FILE)
+        _LAST_POS_SNAPSHOT = snapshot
         log(f"[POS] saved: {pos}")
     except Exception as e:
         log(f"[POS ERROR] save_position: {e}")
@@ -589,6 +817,16 @@ def close_long_market_like(last_price: float, dry_run: bool = DRY_RUN):
 # ------------------------------------------------------------
 # [10] MAIN LOOP - RSI + ADX BOT
 # ------------------------------------------------------------
+def sleep_until_next_candle():
+    """
+    หลับจนถึงขอบแท่งถัดไป (+ CANDLE_CLOSE_GRACE_SEC) ตามเวลา server แต่ไม่เกิน REFRESH_SEC
+    """
+    tf_sec = int(RESOLUTION) * 60
+    now = now_server_ms() / 1000
+    sleep_s = tf_sec - (now % tf_sec) + CANDLE_CLOSE_GRACE_SEC
+    time.sleep(min(sleep_s, REFRESH_SEC))
+
+
 def main_loop():
     log(f"[INIT] Starting RSI+ADX bot on {SYMBOL}, TF={RESOLUTION}, DRY_RUN={DRY_RUN}")
     sync_server_time()
@@ -596,44 +834,47 @@ def main_loop():
     last_candle_ts = None
     last_trade_time = 0.0
 
+    # มี indicator state จากรอบก่อน -> ดึงแค่แท่งหลังจากนั้น ไม่ต้อง warmup ใหม่
+    since_ts = load_ind_state(SYMBOL)
+    if since_ts is not None:
+        log(f"[INIT] restored indicator state, last_ts={since_ts}")
+
     while True:
         try:
-            df = fetch_candles(SYMBOL, RESOLUTION, limit=CANDLE_LIMIT)
-            if df.empty:
+            candles = fetch_candles(SYMBOL, RESOLUTION, limit=CANDLE_LIMIT, since_ts=since_ts)
+            if len(candles) == 0:
                 log("[WARN] NO CANDLES, skip this round")
                 time.sleep(REFRESH_SEC)
                 continue
 
-            latest_row = df.iloc[-1]
-            candle_ts = int(latest_row["ts"])
+            candle_ts = int(candles.ts[-1])
 
             # เช็คว่ามีแท่งใหม่หรือยัง
             if last_candle_ts is not None and candle_ts == last_candle_ts:
                 log("[SKIP] No new candle yet")
-                time.sleep(REFRESH_SEC)
+                time.sleep(NO_NEW_CANDLE_RETRY_SEC)
                 continue
 
             last_candle_ts = candle_ts
 
-            # เติม indicators
-            df = add_indicators(df)
-            last = df.iloc[-1]
-            price     = float(last["close"])
-            rsi_val   = float(last.get("rsi", float("nan")))
-            adx_val   = float(last.get("adx", float("nan")))
-            plus_di   = float(last.get("plus_di", float("nan")))
-            minus_di  = float(last.get("minus_di", float("nan")))
+            # อัปเดต indicators (เฉพาะแท่งใหม่)
+            ind = update_indicators(SYMBOL, candles)
+            price     = float(ind["close"])
+            rsi_val   = float(ind["rsi"])
+            adx_val   = float(ind["adx"])
+            plus_di   = float(ind["plus_di"])
+            minus_di  = float(ind["minus_di"])
 
             log(
-                f"[PRICE] close={price:.4f}, rsi={rsi_val:.2f}, "
-                f"adx={adx_val:.2f}, +di={plus_di:.2f}, -di={minus_di:.2f}"
+                "[PRICE] close=%.4f, rsi=%.2f, adx=%.2f, +di=%.2f, -di=%.2f",
+                price, rsi_val, adx_val, plus_di, minus_di,
             )
 
             pos = load_position()
             in_long = pos.get("side") == "LONG" and pos.get("qty", 0) > 0
             in_short = False  # ไม่มี short จริง
 
-            sig = detect_signal(df, in_long=in_long, in_short=in_short)
+            sig = detect_signal(ind, in_long=in_long, in_short=in_short)
             signal = sig["signal"]
             reason = sig["reason"]
 
@@ -642,7 +883,7 @@ def main_loop():
             if now_t - last_trade_time < COOLDOWN_SEC and signal != "NONE":
                 remain = int(COOLDOWN_SEC - (now_t - last_trade_time))
                 log(f"[COOLDOWN] {remain} sec remaining, skip signal={signal} ({reason})")
-                time.sleep(REFRESH_SEC)
+                sleep_until_next_candle()
                 continue
 
             if signal == "LONG_ENTRY":
@@ -658,7 +899,7 @@ def main_loop():
                 log(f"[RESULT] LONG_EXIT resp={resp}")
 
             else:
-                log(f"[HOLD] signal={signal}, reason={reason}")
+                log("[HOLD] signal=%s, reason=%s", signal, reason)
 
         except KeyboardInterrupt:
             log("[STOP] KeyboardInterrupt received, exiting.")
@@ -666,7 +907,7 @@ def main_loop():
         except Exception as e:
             log(f"[ERROR] main_loop: {e}")
 
-        time.sleep(REFRESH_SEC)
+        sleep_until_next_candle()
 
 
 if __name__ == "__main__":
@@ -7,84 +7,36 @@
 #  + edge filter vs fee (compute_zscore_with_stats + edge_pct)
 # ============================================================
 
-import os, time, hmac, hashlib, json, requests, math, random
+import os, sys, time, math, random, threading, asyncio, logging, signal
 import datetime
-from statistics import mean, pstdev
-from typing import Dict, Any, List, Optional
+from dataclasses import dataclass
+from typing import Dict, Any, List, Optional, Tuple
 from dotenv import load_dotenv
 from collections import deque
+from itertools import islice
+import numpy as np
 
-load_dotenv()
+try:
+    import aiohttp
+except ImportError:  # ไม่มี aiohttp ยัง import ไปใช้ backtest / rolling_zscore ได้ แต่รันบอทจริงไม่ได้
+    aiohttp = None
 
-# ------------------------------------------------------------
-# COLOR CONSTANTS (ANSI)
-# ------------------------------------------------------------
-RESET   = "\033[0m"
-BOLD    = "\033[1m"
-DIM     = "\033[2m"
-
-FG_RED     = "\033[31m"
-FG_GREEN   = "\033[32m"
-FG_YELLOW  = "\033[33m"
-FG_BLUE    = "\033[34m"
-FG_MAGENTA = "\033[35m"
-FG_CYAN    = "\033[36m"
-FG_WHITE   = "\033[37m"
-
-
-def color_for(msg: str) -> str:
-    """
-    เลือกสีตามประเภท log จาก prefix / keyword ในข้อความ
-    ปรับ mapping ตรงนี้ได้ตามชอบ
-    """
-    # ERROR / EXCEPTION
-    if "ERROR" in msg or "EXC" in msg:
-        return FG_RED + BOLD
-
-    # HTTP DEBUG
-    if msg.startswith("[HTTP GET]") or msg.startswith("[HTTP POST]"):
-        return FG_CYAN + DIM
-    if "[HTTP GET ERROR" in msg or "[HTTP POST ERROR" in msg:
-        return FG_RED
-
-    # SYNC / TIME
-    if msg.startswith("[SYNC"):
-        return FG_CYAN
-
-    # POSITION
-    if msg.startswith("[POS]"):
-        return FG_MAGENTA
-
-    # PRICE / Z / HOLD
-    if msg.startswith("[PRICE]"):
-        return FG_BLUE + BOLD
-    if msg.startswith("[HOLD]"):
-        return FG_CYAN
-
-    # BUY / SELL / COOLDOWN
-    if msg.startswith("[BUY "):
-        return FG_GREEN + BOLD
-    if msg.startswith("[SELL]"):
-        return FG_YELLOW + BOLD
-    if msg.startswith("[COOLDOWN]"):
-        return FG_YELLOW
-
-    # SKIP / WARN
-    if msg.startswith("[SKIP"):
-        return FG_YELLOW
-    if "WARN" in msg:
-        return FG_YELLOW + DIM
-    if "NO TRADES" in msg or "WARMUP" in msg:
-        return FG_WHITE + DIM
-
-    # DEFAULT
-    return FG_WHITE
+try:
+    import websocket  # websocket-client
+except ImportError:  # ไม่มีก็กลับไป poll REST เหมือนเดิม
+    websocket = None
 
+from bitkub_common import BitkubSigner, make_logger, json_loads, json_dumps, njit
+
+load_dotenv()
 
 # ------------------------------------------------------------
 # [1] CONFIGURATION
 # ------------------------------------------------------------
 BASE_URL = "https://api.bitkub.com"
+_URL_STATUS = BASE_URL + "/api/status"
+_URL_SERVERTIME = BASE_URL + "/api/v3/servertime"
+_URL_TRADES = BASE_URL + "/api/v3/market/trades"
 API_KEY  = os.getenv("BITKUB_API_KEY", "")
 API_SECRET = (os.getenv("BITKUB_API_SECRET", "") or "").encode()
 
@@ -92,11 +44,20 @@ SYMBOL = "XRP_THB"
 
 WINDOW = 30                # จำนวนจุดข้อมูลที่ใช้คำนวณ Z-score
 REFRESH_SEC = 60           # วินาทีต่อการวนลูป 1 รอบ
-TRADES_FETCH = max(200, WINDOW + 20)
+VWAP_TAIL = 20             # จำนวน trade ท้ายสุดที่ใช้คิด VWAP ต่อรอบ
+TRADES_FETCH = VWAP_TAIL   # ดึง trade แค่เท่าที่ใช้ (1 รอบได้ราคา VWAP จุดเดียว)
+
+# WebSocket trade feed (ใช้ REST แค่ตอน warmup / ตอน feed หลุด)
+USE_WS = True
+WS_URL = "wss://api.bitkub.com/websocket-api/market.trade.thb_" + SYMBOL.split("_")[0].lower()
+WS_STALE_SEC = 120         # ไม่มี message นานเกินนี้ถือว่า feed หลุด -> ใช้ REST แทน
+WS_RECONNECT_SEC = 5
 
 THRESH_Z = 2.1
 ORDER_NOTIONAL_THB = 100
 SLIPPAGE_BPS = 6           # slippage (bps) สำหรับตั้ง bid/ask ให้ match ง่ายขึ้น
+BALANCE_TTL = 15           # วินาทีที่ใช้ยอดคงเหลือจาก cache (ล้าง cache เองทุกครั้งที่ส่งออเดอร์จริง)
+BALANCE_REFRESH_SEC = 5    # task เบื้องหลังดึงยอดใหม่เข้า cache ทุก ๆ กี่วินาที (ต้องน้อยกว่า BALANCE_TTL; 0 = ปิด)
 
 FEE_RATE = 0.0025          # 0.25% ต่อข้าง (ซื้อ 0.25% + ขาย 0.25%)
 FEE_ROUNDTRIP = 2 * FEE_RATE   # ~0.5% ไป-กลับ
@@ -106,78 +67,199 @@ DRY_RUN = True             # True = ทดสอบ, False = ยิง order จ
 
 PRICE_ROUND = 2
 QTY_ROUND = 6
-MAX_SERIES_LEN = 5000
+
+# ค่าคงที่ที่ใช้ทุก tick คำนวณครั้งเดียว (ปัดราคาแบบ half-up ด้วยการคูณ/int แทน round())
+_BID_MULT = 1 - SLIPPAGE_BPS / 10000
+_ASK_MULT = 1 + SLIPPAGE_BPS / 10000
+_PRICE_SCALE = 10 ** PRICE_ROUND
 
 TIME_SYNC_INTERVAL = 300   # วินาทีในการ resync server time
 
 COOLDOWN_SEC = 300         # วินาที cooldown หลังเทรด (เช่น 300 = 5 นาที)
 
 POS_FILE = "Cost.json"     # ไฟล์เก็บสถานะ position
+PRICE_JOURNAL = "z_prices.ring"   # ไฟล์ ring เก็บราคา VWAP ล่าสุดไว้ warm restart (None = ปิด)
 
 # Debug/Networking
 DEBUG_SAMPLE_TRADE = True
-DEBUG_HTTP = True
+DEBUG_HTTP = os.getenv("DEBUG_HTTP", "") == "1"   # เปิด log ระดับ DEBUG ด้วย env DEBUG_HTTP=1
 HTTP_TIMEOUT = 12
 RETRY_MAX = 4
 RETRY_BASE_DELAY = 0.6     # seconds
+KEEPALIVE_SEC = 30         # ping /api/status ให้ connection ใน pool ไม่ idle จนหลุด (0 = ปิด)
+RATE_LIMIT_PER_SEC = 5     # เพดาน request/วินาทีไป Bitkub (token bucket) กันโดน 429 ตอนยิงถี่
+RATE_LIMIT_BURST = 10
 
 COMMON_HEADERS = {
     "Accept": "application/json",
     "Content-Type": "application/json"
 }
 
-session = requests.Session()
+# client async ตัวเดียว (keep-alive pool) สร้างตอนอยู่ใน event loop แล้ว -> ดู get_client()
+_client: Optional["aiohttp.ClientSession"] = None
+
+
+def get_client() -> "aiohttp.ClientSession":
+    global _client
+    if aiohttp is None:
+        raise RuntimeError("Z_trade ต้องใช้ aiohttp (pip install aiohttp)")
+    if _client is None or _client.closed:
+        _client = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=100, limit_per_host=20, keepalive_timeout=60, ttl_dns_cache=300),
+            headers=COMMON_HEADERS,
+            timeout=aiohttp.ClientTimeout(total=HTTP_TIMEOUT),
+        )
+    return _client
+
+
+async def close_client():
+    if _client is not None and not _client.closed:
+        await _client.close()
+
+
+_TIMEOUTS: Dict[float, "aiohttp.ClientTimeout"] = {}
+
+
+def _timeout(total: float) -> "aiohttp.ClientTimeout":
+    # ClientTimeout ต่อค่า timeout สร้างครั้งเดียวแล้วใช้ซ้ำ (ไม่ต้องสร้างใหม่ทุก request)
+    t = _TIMEOUTS.get(total)
+    if t is None:
+        t = _TIMEOUTS[total] = aiohttp.ClientTimeout(total=total)
+    return t
+
+
+def _retryable_status(status: int) -> bool:
+    # retry เฉพาะ 5xx และ 429 — 4xx อื่น (sign/params ผิด) fail ทันที
+    return status == 429 or status >= 500
+
+
+def _is_retryable(e: Exception) -> bool:
+    """exception ที่ควร retry: network/timeout (status error เช็กจาก r.status ก่อนถึงตรงนี้แล้ว)"""
+    if isinstance(e, aiohttp.ClientResponseError):
+        return _retryable_status(e.status)
+    return isinstance(e, (aiohttp.ClientError, asyncio.TimeoutError))
+
+
+def _retry_after(status: int, headers) -> Optional[float]:
+    """อ่าน Retry-After (วินาที) จาก 429 ถ้ามี"""
+    if status != 429 or not headers:
+        return None
+    try:
+        return max(0.0, float(headers.get("Retry-After", "")))
+    except ValueError:
+        return None
+
+
+class TokenBucket:
+    """
+    token bucket แบบ async: เติม rate token ต่อวินาที เก็บได้สูงสุด capacity
+    request ที่เกินโควตารอ (asyncio.sleep) แทนที่จะไปโดน 429 แล้ว backoff ยาว
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.last = time.monotonic()
+
+    async def acquire(self, n: float = 1.0):
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            if self.tokens >= n:
+                self.tokens -= n
+                return
+            await asyncio.sleep((n - self.tokens) / self.rate)
 
 
-def _backoff_sleep(i: int):
-    # jittered exponential backoff
-    delay = RETRY_BASE_DELAY * (2 ** i) + random.uniform(0, 0.2)
-    time.sleep(delay)
+_rate_limiter = TokenBucket(RATE_LIMIT_PER_SEC, RATE_LIMIT_BURST)
+
+
+async def _backoff_sleep(i: int, retry_after: Optional[float] = None):
+    # jittered exponential backoff (หรือเคารพ Retry-After ของ server)
+    if retry_after is not None:
+        delay = retry_after
+    else:
+        delay = RETRY_BASE_DELAY * (2 ** i) + random.uniform(0, 0.2)
+    await asyncio.sleep(delay)
 
 
-def http_get(url, params=None, timeout=HTTP_TIMEOUT):
-    last_exc = None
+async def http_get(url, params=None, timeout=HTTP_TIMEOUT) -> bytes:
+    """GET แล้วคืน body (bytes)"""
     for i in range(RETRY_MAX):
+        last = i == RETRY_MAX - 1
         try:
-            r = session.get(url, params=params, headers=COMMON_HEADERS, timeout=timeout)
-            if DEBUG_HTTP:
-                print(f"[HTTP GET] {r.request.method} {r.url} -> {r.status_code}")
-            r.raise_for_status()
-            return r
+            await _rate_limiter.acquire()
+            async with get_client().get(url, params=params, timeout=_timeout(timeout)) as r:
+                logger.debug("[HTTP GET] %s %s -> %s", r.method, r.url, r.status)
+                if r.status < 400:
+                    return await r.read()
+                if last or not _retryable_status(r.status):
+                    r.raise_for_status()
+                # 5xx/429 ที่ยัง retry ได้: ไม่ต้องสร้าง exception แค่ backoff แล้ววนใหม่
+                logger.debug("[HTTP GET ERROR#%d] %s params=%s status=%s", i + 1, url, params, r.status)
+                retry_after = _retry_after(r.status, r.headers)
         except Exception as e:
-            last_exc = e
-            if DEBUG_HTTP:
-                print(f"[HTTP GET ERROR#{i+1}] {url} params={params} err={e}")
-            _backoff_sleep(i)
-    raise last_exc
-
-
-def http_post(url, headers=None, data="{}", timeout=HTTP_TIMEOUT):
-    h = COMMON_HEADERS.copy()
-    if headers:
-        h.update(headers)
-    last_exc = None
+            logger.debug("[HTTP GET ERROR#%d] %s params=%s err=%s", i + 1, url, params, e)
+            if last or not _is_retryable(e):
+                raise
+            retry_after = None
+        await _backoff_sleep(i, retry_after)
+
+
+async def http_post(url, headers=None, data=b"{}", timeout=HTTP_TIMEOUT) -> bytes:
+    """POST แล้วคืน body (bytes)"""
     for i in range(RETRY_MAX):
+        last = i == RETRY_MAX - 1
         try:
-            r = session.post(url, headers=h, data=data, timeout=timeout)
-            if DEBUG_HTTP:
-                body_dbg = data if len(data) < 300 else data[:300] + "...(+)"
-                print(f"[HTTP POST] {r.request.method} {r.url} -> {r.status_code} body={body_dbg}")
-            r.raise_for_status()
-            return r
+            await _rate_limiter.acquire()
+            async with get_client().post(
+                url, headers=headers, data=data, timeout=_timeout(timeout)
+            ) as r:
+                if logger.isEnabledFor(logging.DEBUG):
+                    body_dbg = data.decode() if isinstance(data, bytes) else data
+                    body_dbg = body_dbg if len(body_dbg) < 300 else body_dbg[:300] + "...(+)"
+                    logger.debug("[HTTP POST] %s %s -> %s body=%s", r.method, r.url, r.status, body_dbg)
+                if r.status < 400:
+                    return await r.read()
+                if last or not _retryable_status(r.status):
+                    r.raise_for_status()
+                logger.debug("[HTTP POST ERROR#%d] %s status=%s", i + 1, url, r.status)
+                retry_after = _retry_after(r.status, r.headers)
         except Exception as e:
-            last_exc = e
-            if DEBUG_HTTP:
-                print(f"[HTTP POST ERROR#{i+1}] {url} err={e}")
-            _backoff_sleep(i)
-    raise last_exc
+            logger.debug("[HTTP POST ERROR#%d] %s err=%s", i + 1, url, e)
+            if last or not _is_retryable(e):
+                raise
+            retry_after = None
+        await _backoff_sleep(i, retry_after)
+
+
+_keepalive_task: Optional[asyncio.Task] = None
+
+
+async def _keepalive_loop():
+    # REFRESH_SEC ยาวกว่า idle timeout ของ connection -> ping เบา ๆ คั่นไว้ ไม่ต้อง handshake TLS ใหม่ตอนยิงจริง
+    url = _URL_STATUS
+    while True:
+        await asyncio.sleep(KEEPALIVE_SEC)
+        try:
+            async with get_client().get(url, timeout=_timeout(3)) as r:
+                await r.read()
+        except Exception as e:
+            logger.debug("[HTTP KEEPALIVE] %s", e)
+
+
+def start_keepalive():
+    global _keepalive_task
+    if KEEPALIVE_SEC > 0:
+        _keepalive_task = asyncio.create_task(_keepalive_loop())
 
 
 # ------------------------------------------------------------
 # [2] SERVER TIME SYNC + LOGGING
 # ------------------------------------------------------------
 _server_offset_ms = 0
-_last_sync_ts = 0
 
 
 def now_server_ms() -> int:
@@ -192,22 +274,20 @@ def ts_hms() -> str:
     return now_server_dt().strftime("%Y-%m-%d %H:%M:%S")
 
 
-def log(msg: str):
-    """
-    log พร้อมสี: timestamp เป็นสีจาง, ตัวข้อความใช้สีตามประเภท
-    """
-    ts = ts_hms()
-    color = color_for(msg)
-    out = f"{DIM}[{ts}]{RESET} {color}{msg}{RESET}"
-    print(out)
+logger = make_logger("z_trade", logging.DEBUG if DEBUG_HTTP else logging.INFO,
+                     offset_ms=lambda: _server_offset_ms)
+
 
+def log(msg: str, *args):
+    # format แบบ lazy: ส่ง args แยกมา จะ format ก็ต่อเมื่อ log ถูกแสดงจริง
+    logger.info(msg, *args)
 
-def sync_server_time():
-    global _server_offset_ms, _last_sync_ts
-    url = f"{BASE_URL}/api/v3/servertime"
+
+async def sync_server_time():
+    global _server_offset_ms
+    url = _URL_SERVERTIME
     try:
-        r = http_get(url, timeout=8)
-        data = r.json()
+        data = json_loads(await http_get(url, timeout=8))
         server_time = None
         if isinstance(data, (int, float, str)):
             server_time = int(data)
@@ -218,48 +298,139 @@ def sync_server_time():
             return
         local_time = int(time.time() * 1000)
         _server_offset_ms = server_time - local_time
-        _last_sync_ts = time.time()
         readable_time = datetime.datetime.fromtimestamp(server_time / 1000)
         log(f"[SYNC] offset={_server_offset_ms} ms, server={readable_time:%Y-%m-%d %H:%M:%S}")
     except Exception as e:
         log(f"[SYNC ERROR] {e}")
 
 
+_time_sync_task: Optional[asyncio.Task] = None
+
+
+async def _time_sync_loop():
+    # task นี้เป็นตัวเดียวที่เขียน _server_offset_ms (หลัง sync ครั้งแรกใน run_loop)
+    while True:
+        await asyncio.sleep(TIME_SYNC_INTERVAL)
+        await sync_server_time()
+
+
+def start_time_sync():
+    global _time_sync_task
+    _time_sync_task = asyncio.create_task(_time_sync_loop())
+
+
 def ts_ms_str() -> str:
-    global _last_sync_ts
-    now = time.time()
-    if now - _last_sync_ts > TIME_SYNC_INTERVAL:
-        sync_server_time()
-    return str(int(now * 1000) + _server_offset_ms)
+    # ไม่ยิง network ใน path ส่ง order, offset ถูก refresh โดย _time_sync_loop
+    return str(int(time.time() * 1000) + _server_offset_ms)
 
 
 # ------------------------------------------------------------
 # [3] AUTH UTILITIES
 # ------------------------------------------------------------
-def sign(timestamp_ms: str, method: str, request_path: str, body: str = "") -> str:
-    payload = (timestamp_ms + method.upper() + request_path + body).encode()
-    return hmac.new(API_SECRET, payload, hashlib.sha256).hexdigest()
-
-
-def build_headers(timestamp_ms: str, signature: Optional[str] = None) -> Dict[str, str]:
-    h = {
-        "Accept": "application/json",
-        "Content-Type": "application/json",
-        "X-BTK-APIKEY": API_KEY,
-        "X-BTK-TIMESTAMP": timestamp_ms,
-    }
-    if signature:
-        h["X-BTK-SIGN"] = signature
-    return h
+_signer = BitkubSigner(API_KEY, API_SECRET)
+sign = _signer.sign
+sign_bytes = _signer.sign_bytes
+build_headers = _signer.build_headers
 
 
 # ------------------------------------------------------------
 # [4] PUBLIC API — robust v3 market/trades (normalized)
 # ------------------------------------------------------------
-def get_trades(sym: str, limit: int = 10) -> List[Dict[str, Any]]:
+@dataclass
+class Trades:
+    """trade แบบ SoA (array แยกตามคอลัมน์) เรียงเวลาเก่า -> ใหม่"""
+    ts: np.ndarray       # int64
+    rate: np.ndarray     # float64
+    amount: np.ndarray   # float64
+
+    def __len__(self) -> int:
+        return self.ts.shape[0]
+
+
+EMPTY_TRADES = Trades(np.empty(0, dtype=np.int64), np.empty(0), np.empty(0))
+
+
+def _trades_from_columns(ts: np.ndarray, rate: np.ndarray, amt: np.ndarray) -> Trades:
+    """
+    ตัดแถวที่ราคา/จำนวน <= 0 ทิ้ง และเรียงตาม ts (ถ้ายังไม่เรียง)
+    """
+    ok = (rate > 0) & (amt > 0)
+    if not ok.all():
+        ts, rate, amt = ts[ok], rate[ok], amt[ok]
+    if ts.shape[0] > 1 and not np.all(ts[1:] >= ts[:-1]):
+        order = np.argsort(ts, kind="stable")
+        ts, rate, amt = ts[order], rate[order], amt[order]
+    return Trades(ts, np.ascontiguousarray(rate), np.ascontiguousarray(amt))
+
+
+def _trades_from_rows(rows) -> Trades:
+    """[(ts, rate, amount), ...] -> Trades"""
+    if not rows:
+        return EMPTY_TRADES
+    a = np.asarray(rows, dtype=np.float64)
+    return _trades_from_columns(a[:, 0].astype(np.int64), a[:, 1], a[:, 2])
+
+
+def _parse_trades_fast(raw: list) -> Trades:
+    """
+    ดูรูปแบบจากแถวแรกครั้งเดียว แล้วสร้างคอลัมน์รวดเดียว
+    แถวไหนรูปแบบไม่ตรงจะโยน KeyError/TypeError/ValueError/IndexError -> ไปใช้ _parse_trades_slow
+    """
+    n = len(raw)
+    first = raw[0]
+    if isinstance(first, dict):
+        # v3 ปกติ: ts + rat + amt, เผื่อบางตลาดใช้ชื่อเต็ม: rate + amount
+        k_rate, k_amt = ("rat", "amt") if "rat" in first else ("rate", "amount")
+        ts = np.fromiter((x["ts"] for x in raw), np.int64, n)
+        rate = np.fromiter((x[k_rate] for x in raw), np.float64, n)
+        amt = np.fromiter((x[k_amt] for x in raw), np.float64, n)
+        return _trades_from_columns(ts, rate, amt)
+    if isinstance(first, (list, tuple)):
+        # list/tuple: [ts, rate, amount, ...]
+        return _trades_from_rows([x[:3] for x in raw])
+    raise TypeError(f"unknown trade row type: {type(first)}")
+
+
+def _parse_trades_slow(raw: list) -> Trades:
+    """parse ทีละแถว ข้ามแถวที่ parse ไม่ได้ (ใช้เมื่อ payload มีหลายรูปแบบปนกัน)"""
+    rows = []
+
+    for x in raw:
+        try:
+            # รูปแบบ list/tuple: [ts, rate, amount, ...]
+            if isinstance(x, (list, tuple)) and len(x) >= 3:
+                ts_raw, rate_raw, amt_raw = x[0], x[1], x[2]
+
+            # รูปแบบ dict
+            elif isinstance(x, dict):
+                # เคส v3 ปกติ: ts + rat + amt
+                if all(k in x for k in ("ts", "rat", "amt")):
+                    ts_raw, rate_raw, amt_raw = x["ts"], x["rat"], x["amt"]
+
+                # เผื่อบางตลาดใช้ชื่อเต็ม: rate + amount
+                elif all(k in x for k in ("ts", "rate", "amount")):
+                    ts_raw, rate_raw, amt_raw = x["ts"], x["rate"], x["amount"]
+
+                else:
+                    # รูปแบบไม่รู้จัก ข้าม
+                    continue
+            else:
+                # ไม่ใช่ list/dict ข้าม
+                continue
+
+            rows.append((int(ts_raw), float(rate_raw), float(amt_raw)))
+
+        except Exception:
+            # ข้าม trade ที่ parse ไม่ได้
+            continue
+
+    return _trades_from_rows(rows)
+
+
+async def get_trades(sym: str, limit: int = 10) -> Trades:
     """
     ดึง trade จาก Bitkub แล้วแปลงให้อยู่รูปแบบเดียว:
-    [{"ts": int, "rate": float, "amount": float}, ...] เรียงจากเก่า -> ใหม่
+    Trades(ts, rate, amount) เป็น numpy array เรียงจากเก่า -> ใหม่
 
     รองรับ 2 รูปแบบหลัก ๆ:
       1) list/tuple: [ts, rate, amount, ...]
@@ -267,214 +438,471 @@ def get_trades(sym: str, limit: int = 10) -> List[Dict[str, Any]]:
          - {"ts","rat","amt", ...}   # รูปแบบ v3 ที่คาดว่าใช้จริง
          - หรือ {"ts","rate","amount"} เผื่อบางตลาดใช้ชื่อเต็ม
     """
-    url = f"{BASE_URL}/api/v3/market/trades"
+    url = _URL_TRADES
     params = {"sym": sym, "lmt": limit}
 
     for i in range(RETRY_MAX):
         try:
-            r = http_get(url, params=params, timeout=10)
-            data = r.json()
+            data = json_loads(await http_get(url, params=params, timeout=10))
 
             # ปกติ v3: {"error":0,"result":[...]}
             if isinstance(data, dict):
                 err = data.get("error")
                 if err not in (0, None):
                     log(f"[TRADES ERROR] error_code={err}")
-                    return []
+                    return EMPTY_TRADES
                 raw = data.get("result", [])
             elif isinstance(data, list):
                 raw = data
             else:
                 log(f"[TRADES WARN] unexpected payload type: {type(data)}")
-                return []
+                return EMPTY_TRADES
 
             if not isinstance(raw, list):
                 log(f"[TRADES WARN] trades result is not a list: {type(raw)}")
-                return []
-
-            trades: List[Dict[str, Any]] = []
+                return EMPTY_TRADES
 
-            for x in raw:
+            # ตัดแถวที่ไม่ถูกต้อง + ensure เรียงตามเวลา เก่า -> ใหม่
+            if not raw:
+                trades = EMPTY_TRADES
+            else:
                 try:
-                    # รูปแบบ list/tuple: [ts, rate, amount, ...]
-                    if isinstance(x, (list, tuple)) and len(x) >= 3:
-                        ts_raw, rate_raw, amt_raw = x[0], x[1], x[2]
+                    trades = _parse_trades_fast(raw)
+                except (KeyError, TypeError, ValueError, IndexError):
+                    trades = _parse_trades_slow(raw)
+            if not trades:
+                log(f"[TRADES WARN] no valid trades (len(raw)={len(raw)})")
+                return EMPTY_TRADES
 
-                    # รูปแบบ dict
-                    elif isinstance(x, dict):
-                        # เคส v3 ปกติ: ts + rat + amt
-                        if all(k in x for k in ("ts", "rat", "amt")):
-                            ts_raw, rate_raw, amt_raw = x["ts"], x["rat"], x["amt"]
+            return trades
 
-                        # เผื่อบางตลาดใช้ชื่อเต็ม: rate + amount
-                        elif all(k in x for k in ("ts", "rate", "amount")):
-                            ts_raw, rate_raw, amt_raw = x["ts"], x["rate"], x["amount"]
+        except Exception as e:
+            log(f"[TRADES EXC#{i+1}] {e}")
+            await _backoff_sleep(i)
 
-                        else:
-                            # รูปแบบไม่รู้จัก ข้าม
-                            continue
-                    else:
-                        # ไม่ใช่ list/dict ข้าม
-                        continue
+    return EMPTY_TRADES
 
-                    ts   = int(ts_raw)
-                    rate = float(rate_raw)
-                    amt  = float(amt_raw)
 
-                    if rate <= 0 or amt <= 0:
-                        continue
+# ------------------------------------------------------------
+# [4.1] PUBLIC API — WebSocket trade feed
+# ------------------------------------------------------------
+_ws_trades: deque = deque(maxlen=TRADES_FETCH)   # (ts, rate, amount)
+_ws_lock = threading.Lock()
+_ws_last_msg = 0.0                                 # time.monotonic() ของ message ล่าสุด
 
-                    trades.append({
-                        "ts": ts,
-                        "rate": rate,
-                        "amount": amt,
-                    })
 
-                except Exception:
-                    # ข้าม trade ที่ parse ไม่ได้
-                    continue
+def _ws_on_message(_ws, message):
+    global _ws_last_msg
+    _ws_last_msg = time.monotonic()
+    # บาง frame มีหลาย JSON คั่นด้วย newline
+    for line in message.splitlines():
+        if not line.strip():
+            continue
+        try:
+            x = json_loads(line)
+            rate = float(x["rat"])
+            amt  = float(x["amt"])
+            ts   = int(x["ts"])
+        except Exception:
+            continue
+        if rate <= 0 or amt <= 0:
+            continue
+        with _ws_lock:
+            _ws_trades.append((ts, rate, amt))
 
-            if not trades:
-                log(f"[TRADES WARN] no valid trades (len(raw)={len(raw)})")
-                return []
 
-            # ensure เรียงตามเวลา เก่า -> ใหม่
-            trades.sort(key=lambda t: t["ts"])
+def _ws_on_error(_ws, err):
+    log(f"[WS ERROR] {err}")
 
-            return trades
 
+def _ws_feed_forever():
+    while True:
+        try:
+            app = websocket.WebSocketApp(WS_URL, on_message=_ws_on_message, on_error=_ws_on_error)
+            app.run_forever(ping_interval=30, ping_timeout=10)
         except Exception as e:
-            log(f"[TRADES EXC#{i+1}] {e}")
-            _backoff_sleep(i)
+            log(f"[WS EXC] {e}")
+        log(f"[WS WARN] disconnected, reconnect in {WS_RECONNECT_SEC}s")
+        time.sleep(WS_RECONNECT_SEC)
+
+
+def start_trade_feed(seed: Trades) -> bool:
+    """
+    เริ่ม thread รับ trade จาก WebSocket (seed ด้วย trade จาก REST)
+    คืน False ถ้าไม่ได้เปิดใช้หรือไม่มี websocket-client
+    """
+    if not USE_WS or websocket is None:
+        return False
+    with _ws_lock:
+        _ws_trades.extend(zip(seed.ts.tolist(), seed.rate.tolist(), seed.amount.tolist()))
+    threading.Thread(target=_ws_feed_forever, name="ws-trades", daemon=True).start()
+    log(f"[WS] subscribed {WS_URL}")
+    return True
+
 
-    return []
+def latest_trades() -> Trades:
+    """
+    trade ล่าสุดจาก WebSocket (เก่า -> ใหม่), ถ้า feed เงียบเกิน WS_STALE_SEC คืนว่างให้ไปใช้ REST
+    """
+    if time.monotonic() - _ws_last_msg > WS_STALE_SEC:
+        return EMPTY_TRADES
+    with _ws_lock:
+        rows = list(_ws_trades)
+    return _trades_from_rows(rows)
+
+
+async def current_trades(use_ws: bool) -> Trades:
+    """trade จาก WebSocket ถ้า feed ยังสด ไม่งั้น fallback เป็น REST"""
+    trades = latest_trades() if use_ws else EMPTY_TRADES
+    if not trades:
+        trades = await get_trades(SYMBOL, limit=TRADES_FETCH)
+    return trades
 
 
 # ------------------------------------------------------------
 # [5] PRIVATE TRADE API
 # ------------------------------------------------------------
-def place_bid(sym: str, thb_amount: float, rate: float, dry_run: bool) -> Dict[str, Any]:
-    method, path = "POST", "/api/v3/market/place-bid"
-    ts = ts_ms_str()
-    payload = {
-        "sym": sym,
-        "amt": float(int(thb_amount)),               # ถ้า Bitkub รองรับทศนิยม ค่อยเปลี่ยน logic ตรงนี้
-        "rat": float(round(rate, PRICE_ROUND)),
-        "typ": "limit",
-    }
-    body = json.dumps(payload, separators=(",", ":"))
-    if dry_run:
-        return {"dry_run": True, "endpoint": path, "payload": payload}
-    sg = sign(ts, method, path, body)
-    r = http_post(BASE_URL + path, headers=build_headers(ts, sg), data=body, timeout=HTTP_TIMEOUT)
-    return r.json()
+# (path, method+path ที่ encode แล้วสำหรับ sign) ของแต่ละ endpoint
+def _endpoint(path: str):
+    # (path, method+path สำหรับ sign, full URL) ประกอบครั้งเดียวตอนโหลดโมดูล
+    return path, b"POST" + path.encode(), BASE_URL + path
+
 
+_EP_PLACE_BID = _endpoint("/api/v3/market/place-bid")
+_EP_PLACE_ASK = _endpoint("/api/v3/market/place-ask")
+_EP_WALLET = _endpoint("/api/v3/market/wallet")
+_EP_BALANCES = _endpoint("/api/v3/market/balances")
+_EMPTY_BODY = b"{}"
 
-def place_ask(sym: str, qty_coin: float, rate: float, dry_run: bool) -> Dict[str, Any]:
-    method, path = "POST", "/api/v3/market/place-ask"
+
+async def _signed_post(endpoint, body: bytes) -> Dict[str, Any]:
+    _, method_path, url = endpoint
     ts = ts_ms_str()
-    payload = {
-        "sym": sym,
-        "amt": float(round(qty_coin, QTY_ROUND)),
-        "rat": float(round(rate, PRICE_ROUND)),
-        "typ": "limit",
-    }
-    body = json.dumps(payload, separators=(",", ":"))
+    sg = sign_bytes(ts, method_path, body)
+    raw = await http_post(url, headers=build_headers(ts, sg), data=body, timeout=HTTP_TIMEOUT)
+    return json_loads(raw)
+
+
+def _bid_amt(thb_amount: float) -> float:
+    return float(int(thb_amount))                   # ถ้า Bitkub รองรับทศนิยม ค่อยเปลี่ยน logic ตรงนี้
+
+
+def _ask_amt(qty_coin: float) -> float:
+    return float(round(qty_coin, QTY_ROUND))
+
+
+_BODY_HEAD: Dict[str, bytes] = {}   # sym -> b'{"sym":"...","amt":' (สร้างครั้งแรกที่เจอ sym นั้นแล้วใช้ซ้ำ)
+
+
+def _body_head(sym: str) -> bytes:
+    head = _BODY_HEAD.get(sym)
+    if head is None:
+        head = _BODY_HEAD[sym] = b'{"sym":' + json_dumps(sym) + b',"amt":'
+    return head
+
+
+async def _place_order(endpoint, sym: str, amt: float, rate: float, dry_run: bool) -> Dict[str, Any]:
+    # ตอนเรียกเหลือแค่ปัด rat แล้วเติม amt/rat ลง body template (bytes) ของ sym ก่อน sign
+    rat = int(rate * _PRICE_SCALE + 0.5) / _PRICE_SCALE
     if dry_run:
-        return {"dry_run": True, "endpoint": path, "payload": payload}
-    sg = sign(ts, method, path, body)
-    r = http_post(BASE_URL + path, headers=build_headers(ts, sg), data=body, timeout=HTTP_TIMEOUT)
-    return r.json()
+        payload = {"sym": sym, "amt": amt, "rat": rat, "typ": "limit"}
+        return {"dry_run": True, "endpoint": endpoint[0], "payload": payload}
+    body = _body_head(sym) + b'%r,"rat":%r,"typ":"limit"}' % (amt, rat)
+    return await _signed_post(endpoint, body)
+
+
+async def place_bid(sym: str, thb_amount: float, rate: float, dry_run: bool) -> Dict[str, Any]:
+    return await _place_order(_EP_PLACE_BID, sym, _bid_amt(thb_amount), rate, dry_run)
+
+
+async def place_ask(sym: str, qty_coin: float, rate: float, dry_run: bool) -> Dict[str, Any]:
+    return await _place_order(_EP_PLACE_ASK, sym, _ask_amt(qty_coin), rate, dry_run)
 
 
 # ------------------------------------------------------------
 # [5.1] ACCOUNT — Balance
 # ------------------------------------------------------------
-def market_wallet() -> Dict[str, Any]:
-    method, path = "POST", "/api/v3/market/wallet"
-    ts = ts_ms_str()
-    body = "{}"
-    sg = sign(ts, method, path, body)
-    r = http_post(BASE_URL + path, headers=build_headers(ts, sg), data=body, timeout=HTTP_TIMEOUT)
-    return r.json()
+async def market_wallet() -> Dict[str, Any]:
+    return await _signed_post(_EP_WALLET, _EMPTY_BODY)
 
 
-def market_balances() -> Dict[str, Any]:
-    method, path = "POST", "/api/v3/market/balances"
-    ts = ts_ms_str()
-    body = "{}"
-    sg = sign(ts, method, path, body)
-    r = http_post(BASE_URL + path, headers=build_headers(ts, sg), data=body, timeout=HTTP_TIMEOUT)
-    return r.json()
+async def market_balances() -> Dict[str, Any]:
+    return await _signed_post(_EP_BALANCES, _EMPTY_BODY)
 
 
-def get_available(asset: str) -> float:
-    # balances → wallet (fallback)
+_bal_cache: Dict[str, Tuple[float, float]] = {}   # asset -> (available, time.monotonic() ตอนดึง)
+_bal_inflight: Optional[asyncio.Future] = None    # refresh ที่กำลังวิ่งอยู่ (ให้ผู้เรียกซ้อนกันรอรอบเดียวกัน)
+_bal_gen = 0   # เพิ่มทุกครั้งที่ invalidate; ผล refresh ที่เริ่มก่อนหน้านั้นจะถูกทิ้ง
+
+
+def invalidate_balances():
+    global _bal_gen, _bal_inflight
+    _bal_gen += 1
+    _bal_inflight = None   # รอบถัดไปต้องยิง request ใหม่ ไม่ไปรอ refresh ที่เริ่มก่อนส่งออเดอร์
+    _bal_cache.clear()
+
+
+async def get_available(asset: str) -> float:
     asset_key = asset.upper()
+    hit = _bal_cache.get(asset_key)
+    if hit is None or time.monotonic() - hit[1] >= BALANCE_TTL:
+        if not await refresh_balances():   # ดึงไม่ได้ทั้งสองทาง -> ไม่ cache ให้ลองใหม่รอบหน้า
+            return 0.0
+        hit = _bal_cache.get(asset_key)
+    return hit[0] if hit is not None else 0.0   # ไม่มี asset นี้ในผลลัพธ์ = ยอดเป็น 0
+
+
+async def refresh_balances() -> bool:
+    """
+    ดึงยอดทุก asset ด้วย POST เดียวแล้วเติม cache (THB/XRP ใช้ response เดียวกัน)
+    เรียกซ้อนกันระหว่างที่ยังไม่เสร็จ จะรอผลของ request เดียวกัน
+    """
+    global _bal_inflight
+    if _bal_inflight is None or _bal_inflight.done():
+        _bal_inflight = asyncio.ensure_future(_fetch_balances(_bal_gen))
+    return await asyncio.shield(_bal_inflight)
+
+
+async def _fetch_balances(gen: int) -> bool:
+    # balances → wallet (fallback); gen = _bal_gen ตอนสั่ง refresh
     try:
-        res = market_balances()
-        if res.get("result") and res["result"].get(asset_key):
-            node = res["result"][asset_key]
-            if isinstance(node, dict) and "available" in node:
-                return float(node["available"])
+        result = (await market_balances()).get("result")
+        if gen != _bal_gen:   # มี invalidate ระหว่างรอ -> ยอดนี้เป็นของก่อนส่งออเดอร์ ห้ามเขียนทับ
+            return False
+        if isinstance(result, dict) and result:
+            now = time.monotonic()
+            for asset_key, node in result.items():
+                if isinstance(node, dict) and "available" in node:
+                    _bal_cache[asset_key] = (float(node["available"]), now)
+            return True
     except Exception as e:
         log(f"[BAL ERR] balances {e}")
     try:
-        res = market_wallet()
-        if res.get("result") and asset_key in res["result"]:
-            return float(res["result"][asset_key])
+        result = (await market_wallet()).get("result")
+        if gen != _bal_gen:
+            return False
+        if isinstance(result, dict):
+            now = time.monotonic()
+            for asset_key, value in result.items():
+                _bal_cache[asset_key] = (float(value), now)
+            return True
     except Exception as e:
         log(f"[BAL ERR] wallet {e}")
-    return 0.0
+    return False
+
+
+_balance_task: Optional[asyncio.Task] = None
+
+
+async def _balance_refresh_loop():
+    # เติม cache ไว้ก่อนเสมอ -> get_available ใน run_loop เป็นแค่ dict lookup ไม่ต้องรอ POST
+    while True:
+        await refresh_balances()
+        await asyncio.sleep(BALANCE_REFRESH_SEC)
+
+
+def start_balance_refresh():
+    global _balance_task
+    if BALANCE_REFRESH_SEC > 0:
+        _balance_task = asyncio.create_task(_balance_refresh_loop())
 
 
 # ------------------------------------------------------------
 # [6] STRATEGY FUNCTIONS — VWAP + Z-score
 # ------------------------------------------------------------
-def vwap_tail(trades: List[Dict[str, Any]], tail: int = 20) -> Optional[float]:
+@njit(cache=True)
+def _vwap_nb(rates, amts, tail):
+    n = rates.shape[0]
+    start = n - tail if n > tail else 0
+    num = 0.0
+    qty = 0.0
+    for i in range(start, n):
+        num += rates[i] * amts[i]
+        qty += amts[i]
+    if qty > 0.0:
+        return num / qty
+    # ถ้าไม่มี trade ที่ใช้ได้เลย ให้ fallback เป็นราคาของ trade ล่าสุดจริง ๆ
+    return rates[n - 1]
+
+
+@njit(cache=True)
+def _zscore_nb(sample):
+    # คืน (z ของค่าท้ายสุด, mean, pstdev) ของ sample ใน loop เดียว
+    w = sample.shape[0]
+    mu = 0.0
+    for i in range(w):
+        mu += sample[i]
+    mu /= w
+    ss = 0.0
+    for i in range(w):
+        d = sample[i] - mu
+        ss += d * d
+    sig = math.sqrt(ss / w)
+    if sig == 0.0:
+        sig = 1e-9
+    return (sample[w - 1] - mu) / sig, mu, sig
+
+
+def warmup_kernels():
+    """เรียก kernel numba กับข้อมูลเล็ก ๆ ครั้งแรกก่อนเข้า loop (compile/โหลด cache ตอนนี้ ไม่ใช่ตอนเทรด)"""
+    x = np.ones(4, dtype=np.float64)
+    _vwap_nb(x, x, 2)
+    _zscore_nb(x)
+
+
+def vwap_tail(rates: np.ndarray, amts: np.ndarray, tail: int = 20) -> Optional[float]:
     """
-    คำนวณ VWAP จาก trade ช่วงท้ายสุดของ list (ที่ normalize แล้ว)
-    trades ต้องอยู่ในรูป [{"ts","rate","amount"}, ...] เรียงเวลาเก่า->ใหม่
+    คำนวณ VWAP จาก trade ช่วงท้ายสุด (คอลัมน์ rate / amount ของ Trades ที่กรองแถวเสียออกแล้ว)
     """
-    if not trades:
+    if rates.shape[0] == 0:
         return None
+    return float(_vwap_nb(rates, amts, tail))
 
-    t = trades[-min(tail, len(trades)):]
-    total_notional = 0.0
-    total_qty = 0.0
 
-    for x in t:
-        try:
-            rate = float(x["rate"])
-            amt  = float(x["amount"])
-        except (KeyError, TypeError, ValueError):
-            continue
+def _tail(series, window: int) -> np.ndarray:
+    """window ค่าท้ายของ PriceRing/list/deque เป็น np.ndarray (ไม่ copy ทั้ง series)"""
+    if isinstance(series, PriceRing):
+        return series.tail_view(window)
+    return np.fromiter(islice(reversed(series), window), dtype=np.float64, count=window)[::-1]
 
-        if rate <= 0 or amt <= 0:
-            continue
 
-        total_notional += rate * amt
-        total_qty      += amt
+def compute_zscore(series: List[float], window: int) -> Optional[float]:
+    """ฟังก์ชันเดิม (ยังเก็บไว้เผื่อใช้ที่อื่น)"""
+    if len(series) < window or window < 2:
+        return None
+    z, _, _ = _zscore_nb(_tail(series, window))
+    return z
+
 
-    if total_qty > 0:
-        return total_notional / total_qty
+class PriceRing:
+    """
+    ring buffer ขนาดคงที่บน np.ndarray (float64) แทน deque(maxlen=...)
+    append ไม่มี heap allocation; tail_view(n) คืน slice แบบ zero-copy ถ้าไม่คร่อมรอยต่อ
+    """
 
-    # ถ้าไม่มี trade ที่ใช้ได้เลย ให้ fallback เป็นราคาของ trade ล่าสุดจริง ๆ
-    last = t[-1]
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.buf = np.empty(capacity, dtype=np.float64)
+        self.idx = 0      # ช่องที่จะเขียนถัดไป
+        self.filled = 0
+
+    def __len__(self) -> int:
+        return self.filled
+
+    def append(self, x: float) -> Optional[float]:
+        """ใส่ค่าใหม่ คืนค่าเก่าสุดที่ถูกเขียนทับ (None ถ้ายังไม่เต็ม)"""
+        i = self.idx
+        old = float(self.buf[i]) if self.filled == self.capacity else None
+        self.buf[i] = x
+        self.idx = i + 1 if i + 1 < self.capacity else 0
+        if old is None:
+            self.filled += 1
+        return old
+
+    def tail_view(self, n: int) -> np.ndarray:
+        """n ค่าท้ายสุด (เก่า -> ใหม่); copy เฉพาะตอนคร่อมรอยต่อของ ring"""
+        n = min(n, self.filled)
+        start = self.idx - n
+        if start >= 0:
+            return self.buf[start:self.idx]
+        return np.concatenate((self.buf[start:], self.buf[:self.idx]))
+
+
+class PriceJournal:
+    """
+    เก็บ (epoch ts, px) ล่าสุดลงไฟล์ ring ผ่าน np.memmap เพื่อให้ restart แล้วเทรดต่อได้เลย
+    ไม่ต้องรอ warmup ใหม่ทั้ง WINDOW; เขียนทีละช่องต่อ tick ไม่ fsync (เป็นแค่ cache)
+    """
+
+    def __init__(self, path: str, capacity: int):
+        self.capacity = capacity
+        reuse = os.path.exists(path) and os.path.getsize(path) == capacity * 16
+        self.mm = np.memmap(path, dtype=np.float64, mode="r+" if reuse else "w+", shape=(capacity, 2))
+        # ช่องถัดจาก ts ล่าสุด คือช่องที่จะเขียนต่อ (ไฟล์ใหม่ memmap w+ เป็น 0 ทั้งหมด)
+        self.idx = (int(np.argmax(self.mm[:, 0])) + 1) % capacity if reuse else 0
+
+    def append(self, ts: float, px: float):
+        self.mm[self.idx, 0] = ts
+        self.mm[self.idx, 1] = px
+        self.idx = self.idx + 1 if self.idx + 1 < self.capacity else 0
+
+    def recent(self, max_gap: float) -> np.ndarray:
+        """
+        ราคาช่วงท้ายที่ต่อเนื่องกันจนถึงตอนนี้ (เก่า -> ใหม่)
+        ตัดทิ้งถ้าจุดล่าสุดเก่ากว่า max_gap หรือช่วงไหนขาดหายเกิน max_gap
+        """
+        rows = np.asarray(self.mm[self.mm[:, 0] > 0])
+        if rows.shape[0] == 0:
+            return rows[:, 1]
+        rows = rows[np.argsort(rows[:, 0], kind="stable")]
+        ts = np.append(rows[:, 0], time.time())
+        gaps = np.flatnonzero(np.diff(ts) > max_gap)
+        start = gaps[-1] + 1 if gaps.shape[0] else 0
+        return rows[start:, 1]
+
+
+def open_price_journal() -> Optional[PriceJournal]:
+    if not PRICE_JOURNAL:
+        return None
     try:
-        return float(last["rate"])
-    except Exception:
+        return PriceJournal(PRICE_JOURNAL, 2 * WINDOW)
+    except (OSError, ValueError) as e:
+        log(f"[WARMUP] price journal disabled: {e}")
         return None
 
 
-def compute_zscore(series: List[float], window: int) -> Optional[float]:
-    """ฟังก์ชันเดิม (ยังเก็บไว้เผื่อใช้ที่อื่น)"""
-    if len(series) < window or window < 2:
-        return None
-    sample = list(series)[-window:]
-    mu = mean(sample)
-    sig = pstdev(sample) or 1e-9
-    return (series[-1] - mu) / sig
+class RollingStats:
+    """
+    mean / pstdev ของ window ล่าสุดแบบ O(1) ต่อจุด (Welford + เลื่อน window)
+    ใช้แทนการเรียก statistics.mean/pstdev กับ slice ใหม่ทุกรอบ
+    """
+
+    def __init__(self, window: int):
+        self.window = window
+        self.buf = PriceRing(window)
+        self.mean = 0.0
+        self.m2 = 0.0   # ผลรวมกำลังสองของส่วนเบี่ยงเบน
+        self._since_rebuild = 0
+
+    def __len__(self) -> int:
+        return len(self.buf)
+
+    def push(self, x: float):
+        old = self.buf.append(x)
+        if old is None:
+            delta = x - self.mean
+            self.mean += delta / len(self.buf)
+            self.m2 += delta * (x - self.mean)
+        else:
+            # ค่าเก่าสุดหลุดจาก window ใส่จุดใหม่ (n คงที่)
+            old_mean = self.mean
+            self.mean += (x - old) / self.window
+            self.m2 += (x - old) * (x - self.mean + old - old_mean)
+            self._since_rebuild += 1
+            if self._since_rebuild >= self.window:
+                self._rebuild()
+        if self.m2 < 0.0:   # กัน error ปัดเศษจนติดลบ
+            self.m2 = 0.0
+
+    def _rebuild(self):
+        # คำนวณ mean/m2 ใหม่จากค่าจริงใน window ทุก ๆ window จุด กัน error ปัดเศษสะสมตอนรันยาว ๆ
+        v = self.buf.tail_view(self.window)
+        self.mean = float(v.mean())
+        d = v - self.mean
+        self.m2 = float(d @ d)
+        self._since_rebuild = 0
+
+    def pstdev(self) -> float:
+        n = len(self.buf)
+        return math.sqrt(self.m2 / n) if n else 0.0
+
+    def zscore_with_stats(self, x: float):
+        """คืนค่า (z, mean, std) เหมือน compute_zscore_with_stats"""
+        if len(self.buf) < self.window or self.window < 2:
+            return None, None, None
+        mu = self.mean
+        sig = self.pstdev() or 1e-9
+        return (x - mu) / sig, mu, sig
 
 
 def compute_zscore_with_stats(series: List[float], window: int):
@@ -484,11 +912,7 @@ def compute_zscore_with_stats(series: List[float], window: int):
     """
     if len(series) < window or window < 2:
         return None, None, None
-    sample = list(series)[-window:]
-    mu = mean(sample)
-    sig = pstdev(sample) or 1e-9
-    z = (series[-1] - mu) / sig
-    return z, mu, sig
+    return _zscore_nb(_tail(series, window))
 
 
 # ------------------------------------------------------------
@@ -503,32 +927,45 @@ def load_position():
     """โหลดสถานะ position จากไฟล์ JSON (ถ้ามี)"""
     global position_xrp, position_cost_thb, realized_pnl_thb
     if not os.path.exists(POS_FILE):
-        print("[POS] position file not found. starting fresh.")
+        log("[POS] position file not found. starting fresh.")
         return
     try:
-        with open(POS_FILE, "r") as f:
-            data = json.load(f)
+        with open(POS_FILE, "rb") as f:
+            data = json_loads(f.read())
         position_xrp      = float(data.get("position_xrp", 0.0))
         position_cost_thb = float(data.get("position_cost_thb", 0.0))
         realized_pnl_thb  = float(data.get("realized_pnl_thb", 0.0))
-        print(f"[POS] loaded: qty={position_xrp} cost_sum={position_cost_thb} realized={realized_pnl_thb}")
+        log(f"[POS] loaded: qty={position_xrp} cost_sum={position_cost_thb} realized={realized_pnl_thb}")
     except Exception as e:
-        print(f"[POS ERROR] failed to load position: {e}")
+        log(f"[POS ERROR] failed to load position: {e}")
+
+
+_last_saved_blob: Optional[bytes] = None   # เนื้อไฟล์ที่เขียนล่าสุด (ข้ามถ้าไม่เปลี่ยน)
 
 
 def save_position():
-    """บันทึกสถานะ position ลงไฟล์ JSON"""
+    """
+    บันทึกสถานะ position ลงไฟล์ JSON แบบ atomic (เขียนไฟล์ .tmp แล้ว os.replace)
+    ถ้าค่าไม่เปลี่ยนจากที่เขียนไว้ล่าสุดจะข้ามการเขียน
+    """
+    global _last_saved_blob
     data = {
         "position_xrp": position_xrp,
         "position_cost_thb": position_cost_thb,
         "realized_pnl_thb": realized_pnl_thb,
     }
     try:
-        with open(POS_FILE, "w") as f:
-            json.dump(data, f, indent=2)
-        print("[POS] saved.")
+        blob = json_dumps(data)
+        if blob == _last_saved_blob:
+            return
+        tmp = POS_FILE + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(blob)
+        os.replace(tmp, POS_FILE)
+        _last_saved_blob = blob
+        log("[POS] saved.")
     except Exception as e:
-        print(f"[POS ERROR] failed to save: {e}")
+        log(f"[POS ERROR] failed to save: {e}")
 
 
 def pos_avg_cost() -> float:
@@ -620,50 +1057,86 @@ def log_position(px: Optional[float] = None):
     )
 
 
+_next_tick = 0.0   # time.monotonic() ที่รอบถัดไปควรเริ่ม (นับจากต้นรอบ ไม่ใช่ท้ายรอบ -> ไม่ drift)
+
+
+async def _end_tick(stop: asyncio.Event):
+    # รอรอบถัดไป (หรือจนกว่า stop จะถูก set)
+    global _next_tick
+    now = time.monotonic()
+    _next_tick += REFRESH_SEC
+    if _next_tick < now:   # ช้ากว่ากำหนดทั้งรอบ (เช่นเครื่อง suspend) -> นับใหม่จากตอนนี้ ไม่ยิงรัวชดเชย
+        _next_tick = now
+    try:
+        await asyncio.wait_for(stop.wait(), timeout=_next_tick - now)
+    except asyncio.TimeoutError:
+        pass
+
+
 # ------------------------------------------------------------
 # [7] MAIN LOOP (with COOLDOWN + POSITION + EDGE FILTER)
 # ------------------------------------------------------------
-def run_loop():
+async def run_loop(stop: asyncio.Event):
+    global _next_tick
     # โหลดสถานะ position จากไฟล์ (ถ้ามี)
     load_position()
 
-    sync_server_time()
-    price_series: deque = deque(maxlen=MAX_SERIES_LEN)
-
-    last_trade_ts = 0.0   # เวลาเทรดล่าสุด (epoch seconds)
+    await sync_server_time()
+    start_time_sync()
+    start_keepalive()
+    start_balance_refresh()
+    warmup_kernels()
+    z_stats = RollingStats(WINDOW)
+
+    # เติมราคาจากรอบก่อน restart (ถ้ายังต่อเนื่อง) -> ไม่ต้องนั่งรอ warmup ใหม่ทั้ง WINDOW
+    journal = open_price_journal()
+    if journal is not None:
+        seed = journal.recent(max_gap=3 * REFRESH_SEC)[-WINDOW:]
+        for px in seed:
+            z_stats.push(float(px))
+        if seed.shape[0]:
+            log(f"[WARMUP] restored {seed.shape[0]}/{WINDOW} prices from {PRICE_JOURNAL}")
+
+    last_trade_ts: Optional[float] = None   # time.monotonic() ตอนเทรดล่าสุด (ไม่โดนผลจากการปรับนาฬิกาเครื่อง)
     debug_counter = 0
 
+    # REST ใช้ backfill ตอนเริ่ม แล้วรับ trade ต่อจาก WebSocket
+    use_ws = start_trade_feed(await get_trades(SYMBOL, limit=TRADES_FETCH))
+
     log(f"Bitkub Mean Reversion Bot — {SYMBOL}")
     log(f"WINDOW={WINDOW} THRESH_Z={THRESH_Z} DRY_RUN={DRY_RUN}")
     log(f"COOLDOWN_SEC={COOLDOWN_SEC}")
     log(f"FEE_ROUNDTRIP={FEE_ROUNDTRIP*100:.3f}% EDGE_BUFFER={EDGE_BUFFER*100:.3f}%")
 
-    while True:
+    _next_tick = time.monotonic()
+    while not stop.is_set():
         try:
-            trades = get_trades(SYMBOL, limit=TRADES_FETCH)
+            trades = await current_trades(use_ws)
             if not trades:
                 log(f"[NO TRADES] sym={SYMBOL} lmt={TRADES_FETCH}. retry in {REFRESH_SEC}s")
-                time.sleep(REFRESH_SEC)
+                await _end_tick(stop)
                 continue
 
             debug_counter += 1
             if DEBUG_SAMPLE_TRADE and trades and debug_counter % 5 == 0:
                 # ทุก ๆ 5 รอบ แสดง trade ล่าสุดที่ normalize แล้ว
-                log(f"[DEBUG] trade sample (norm last): {trades[-1]}")
+                log(f"[DEBUG] trade sample (norm last): ts={trades.ts[-1]} rate={trades.rate[-1]} amount={trades.amount[-1]}")
 
-            px = vwap_tail(trades, tail=20)
+            px = vwap_tail(trades.rate, trades.amount, tail=VWAP_TAIL)
             if px is None:
                 log("[WARMUP] no price yet, waiting...")
-                time.sleep(REFRESH_SEC)
+                await _end_tick(stop)
                 continue
 
-            price_series.append(px)
+            z_stats.push(px)
+            if journal is not None:
+                journal.append(time.time(), px)
 
             # ใช้ zscore + mean + std พร้อมกัน
-            z, mu, sig = compute_zscore_with_stats(list(price_series), WINDOW)
+            z, mu, sig = z_stats.zscore_with_stats(px)
             if z is None or mu is None:
-                log(f"[WARMUP] collecting data... px={px:.4f} len={len(price_series)}/{WINDOW}")
-                time.sleep(REFRESH_SEC)
+                log(f"[WARMUP] collecting data... px={px:.4f} len={len(z_stats)}/{WINDOW}")
+                await _end_tick(stop)
                 continue
 
             # --- EDGE FILTER: เช็คว่าเบี่ยงจาก mean กี่ % ---
@@ -672,23 +1145,19 @@ def run_loop():
 
             if edge_pct < min_edge:
                 log(f"[SKIP EDGE] px={px:.4f} mu={mu:.4f} edge={edge_pct*100:.2f}% < {min_edge*100:.2f}% | z={z:.2f}")
-                time.sleep(REFRESH_SEC)
+                await _end_tick(stop)
                 continue
             # ------------------------------------------------
 
-            bid_px = round(px * (1 - SLIPPAGE_BPS / 10000), PRICE_ROUND)
-            ask_px = round(px * (1 + SLIPPAGE_BPS / 10000), PRICE_ROUND)
+            bid_px = int(px * _BID_MULT * _PRICE_SCALE + 0.5) / _PRICE_SCALE
+            ask_px = int(px * _ASK_MULT * _PRICE_SCALE + 0.5) / _PRICE_SCALE
 
             # แสดงราคาที่ใช้ กับเทรดล่าสุดเพื่อเช็คความแม่น
-            last_trade = trades[-1]
-            try:
-                log(f"[PRICE] vwap_tail={px:.4f} mu={mu:.4f} | last_trade_rate={last_trade['rate']:.4f} amt={last_trade['amount']} | z={z:.2f}")
-            except Exception:
-                log(f"[PRICE] vwap_tail={px:.4f} mu={mu:.4f} | last_trade={last_trade} | z={z:.2f}")
+            log(f"[PRICE] vwap_tail={px:.4f} mu={mu:.4f} | last_trade_rate={trades.rate[-1]:.4f} amt={trades.amount[-1]} | z={z:.2f}")
 
             # --------- COOLDOWN CHECK ----------
-            now_ts = time.time()
-            in_cooldown = (now_ts - last_trade_ts) < COOLDOWN_SEC if last_trade_ts > 0 else False
+            now_ts = time.monotonic()
+            in_cooldown = last_trade_ts is not None and (now_ts - last_trade_ts) < COOLDOWN_SEC
             cooldown_left = COOLDOWN_SEC - (now_ts - last_trade_ts) if in_cooldown else 0
             # -----------------------------------
 
@@ -696,16 +1165,18 @@ def run_loop():
                 if in_cooldown:
                     log(f"[COOLDOWN] skip BUY, remaining={cooldown_left:.1f}s | px={px:.4f} z={z:.2f}")
                 else:
-                    thb_avail = get_available("THB")
+                    # ยอดคงเหลือดึงเฉพาะตอนมีสัญญาณ (ปกติได้จาก cache ที่ task เบื้องหลังเติมไว้)
+                    thb_avail = await get_available("THB")
                     if thb_avail < ORDER_NOTIONAL_THB:
                         log(f"[SKIP BUY] THB={thb_avail:.2f} < {ORDER_NOTIONAL_THB} | px={px:.4f} z={z:.2f}")
                     else:
                         qty_est = ORDER_NOTIONAL_THB / bid_px
-                        resp = place_bid(SYMBOL, ORDER_NOTIONAL_THB, bid_px, dry_run=DRY_RUN)
+                        resp = await place_bid(SYMBOL, ORDER_NOTIONAL_THB, bid_px, dry_run=DRY_RUN)
 
                         # อัพเดต position จริงเฉพาะตอน DRY_RUN = False
                         if not DRY_RUN:
                             on_fill_buy(qty_est, bid_px)
+                            invalidate_balances()
 
                         log(f"[BUY ] z={z:.2f} px={px:.4f} bid≈{bid_px} THB≈{ORDER_NOTIONAL_THB} (~{qty_est:.6f} XRP) -> {resp}")
                         log_position(px)
@@ -716,17 +1187,18 @@ def run_loop():
                 if in_cooldown:
                     log(f"[COOLDOWN] skip SELL, remaining={cooldown_left:.1f}s | px={px:.4f} z={z:.2f}")
                 else:
-                    xrp_avail = get_available("XRP")
+                    xrp_avail = await get_available("XRP")
                     if xrp_avail <= 0:
                         log(f"[SKIP SELL] XRP={xrp_avail:.6f} | px={px:.4f} z={z:.2f}")
                     else:
                         sell_qty = round(xrp_avail * 0.5, QTY_ROUND)
                         if sell_qty > 0:
-                            resp = place_ask(SYMBOL, sell_qty, ask_px, dry_run=DRY_RUN)
+                            resp = await place_ask(SYMBOL, sell_qty, ask_px, dry_run=DRY_RUN)
 
                             # อัพเดต position จริงเฉพาะตอน DRY_RUN = False
                             if not DRY_RUN:
                                 on_fill_sell(sell_qty, ask_px)
+                                invalidate_balances()
 
                             log(f"[SELL] z={z:.2f} px={px:.4f} ask≈{ask_px} qty≈{sell_qty:.6f} -> {resp}")
                             log_position(px)
@@ -739,16 +1211,127 @@ def run_loop():
                 # ถ้าอยากเห็นสถานะบ่อยขึ้น เปิดบรรทัดนี้ได้
                 # log_position(px)
 
-        except requests.HTTPError as e:
-            log(f"[HTTP ERROR] {getattr(e.response, 'text', str(e))}")
+        except aiohttp.ClientResponseError as e:
+            log(f"[HTTP ERROR] {e.status} {e.message}")
         except Exception as e:
             log(f"[ERROR] {e}")
 
-        time.sleep(REFRESH_SEC)
+        await _end_tick(stop)
+
+
+# ------------------------------------------------------------
+# [7.1] BACKTEST — replay ราคาย้อนหลังแบบ vectorized
+# ------------------------------------------------------------
+def rolling_zscore(prices: np.ndarray, window: int = WINDOW):
+    """
+    (z, mean, pstdev) ของทุกจุดตั้งแต่ index window-1 ด้วย cumsum รอบเดียว (แทนการวน RollingStats ทีละ tick)
+    ลบค่าเฉลี่ยรวมออกก่อน cumsum เพื่อลด cancellation ของ sum(x^2) - sum(x)^2/n
+    """
+    x = np.asarray(prices, dtype=np.float64)
+    off = float(x.mean()) if x.shape[0] else 0.0
+    x = x - off
+    csum = np.concatenate(([0.0], np.cumsum(x)))
+    csum2 = np.concatenate(([0.0], np.cumsum(x * x)))
+    win_sum = csum[window:] - csum[:-window]
+    win_sum2 = csum2[window:] - csum2[:-window]
+    mean = win_sum / window
+    var = np.maximum(win_sum2 / window - mean * mean, 0.0)   # pstdev เหมือน RollingStats
+    sig = np.sqrt(var)
+    sig[sig == 0.0] = 1e-9
+    z = (x[window - 1:] - mean) / sig
+    return z, mean + off, sig
+
+
+def backtest(prices: np.ndarray, thb: float = 10000.0, window: int = WINDOW) -> Dict[str, Any]:
+    """
+    จำลองกลยุทธ์เดียวกับ run_loop บนราคา VWAP ย้อนหลัง (1 จุด = 1 รอบ REFRESH_SEC)
+    สัญญาณ (z / edge filter) คำนวณเป็น mask ทั้งก้อน แล้ววนเฉพาะจุดที่มีสัญญาณเพื่อคิด cooldown / ยอดเงิน
+    """
+    prices = np.asarray(prices, dtype=np.float64)
+    xrp = 0.0
+    cost = 0.0
+    realized = 0.0
+    trades: List[Tuple[int, str, float, float]] = []   # (index, side, price, qty)
+
+    if prices.shape[0] >= window >= 2:
+        z, mu, _ = rolling_zscore(prices, window)
+        px = prices[window - 1:]
+        edge_ok = np.abs(px - mu) / mu >= FEE_ROUNDTRIP + EDGE_BUFFER
+        buy = edge_ok & (z <= -THRESH_Z)
+        sell = edge_ok & (z >= THRESH_Z)
+        cooldown_ticks = math.ceil(COOLDOWN_SEC / REFRESH_SEC)
+        bid = np.floor(px * _BID_MULT * _PRICE_SCALE + 0.5) / _PRICE_SCALE
+        ask = np.floor(px * _ASK_MULT * _PRICE_SCALE + 0.5) / _PRICE_SCALE
+
+        last = None
+        for i in np.flatnonzero(buy | sell).tolist():
+            if last is not None and i - last < cooldown_ticks:
+                continue
+            if buy[i]:
+                if thb < ORDER_NOTIONAL_THB:
+                    continue
+                qty = ORDER_NOTIONAL_THB / bid[i]
+                gross = qty * bid[i]
+                thb -= gross * (1 + FEE_RATE)
+                xrp += qty
+                cost += gross * (1 + FEE_RATE)
+                trades.append((i + window - 1, "BUY", float(bid[i]), qty))
+            else:
+                qty = round(xrp * 0.5, QTY_ROUND)
+                if qty <= 0:
+                    continue
+                portion = min(qty / xrp, 1.0)
+                proceed = qty * ask[i] * (1 - FEE_RATE)
+                realized += proceed - cost * portion
+                cost -= cost * portion
+                thb += proceed
+                xrp -= qty
+                trades.append((i + window - 1, "SELL", float(ask[i]), qty))
+            last = i
+
+    last_px = float(prices[-1]) if prices.shape[0] else 0.0
+    return {
+        "trades": trades,
+        "thb": float(thb),
+        "xrp": float(xrp),
+        "realized_pnl": float(realized),
+        "unrealized_pnl": float(xrp * last_px * (1 - FEE_RATE) - cost),
+        "equity": float(thb + xrp * last_px),
+    }
 
 
 # ------------------------------------------------------------
 # [8] ENTRY POINT
 # ------------------------------------------------------------
+async def main():
+    if aiohttp is None:
+        raise SystemExit("Z_trade ต้องใช้ aiohttp (pip install aiohttp)")
+    # สร้าง Event ใน loop ที่รันอยู่ (สร้างตอน import จะผูกกับคนละ loop บน Python 3.8/3.9)
+    # set จาก SIGINT/SIGTERM -> ตื่นจาก _end_tick ทันทีแล้วออกจาก run_loop
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except (NotImplementedError, AttributeError):   # Windows: ใช้ KeyboardInterrupt ตามเดิม
+            pass
+    try:
+        await run_loop(stop)
+        log("[STOP] shutting down")
+    finally:
+        for task in (_time_sync_task, _keepalive_task, _balance_task):
+            if task is not None:
+                task.cancel()
+        await close_client()
+
+
 if __name__ == "__main__":
-    run_loop()
+    if len(sys.argv) > 2 and sys.argv[1] == "--backtest":
+        # python Z_trade.py --backtest prices.csv  (คอลัมน์สุดท้าย = ราคา VWAP ต่อรอบ)
+        res = backtest(np.loadtxt(sys.argv[2], delimiter=",", ndmin=2)[:, -1])
+        for t in res["trades"]:
+            log(f"[{t[1]:<4}] i={t[0]} px={t[2]} qty≈{t[3]:.6f}")
+        log(f"[BACKTEST] trades={len(res['trades'])} THB={res['thb']:.2f} XRP={res['xrp']:.6f} "
+            f"realized={res['realized_pnl']:.2f} unrealized={res['unrealized_pnl']:.2f} equity={res['equity']:.2f}")
+    else:
+        asyncio.run(main())
@@ -0,0 +1,202 @@
+"""
+ของที่ bot ทุกตัวใน Strategy/ ใช้ร่วมกัน (เดิม copy ไว้ในแต่ละไฟล์)
+"""
+import sys, hmac, hashlib, json, datetime, logging, logging.handlers, queue, atexit
+from typing import Any, Callable, Dict, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    import orjson
+except ImportError:  # ไม่มี orjson ก็ใช้ json มาตรฐานแทน
+    orjson = None
+
+
+# ------------------------------------------------------------
+# COLOR CONSTANTS (ANSI) + สีของ log
+# ------------------------------------------------------------
+RESET   = "\033[0m"
+BOLD    = "\033[1m"
+DIM     = "\033[2m"
+
+FG_RED     = "\033[31m"
+FG_GREEN   = "\033[32m"
+FG_YELLOW  = "\033[33m"
+FG_BLUE    = "\033[34m"
+FG_MAGENTA = "\033[35m"
+FG_CYAN    = "\033[36m"
+FG_WHITE   = "\033[37m"
+
+# สีตาม tag คำแรกในวงเล็บเหลี่ยม เช่น "[HTTP GET] ..." -> "HTTP", "[BUY LONG] ..." -> "BUY"
+_COLOR_MAP = {
+    "HTTP": FG_CYAN + DIM,
+    "SYNC": FG_CYAN,
+    "POS": FG_MAGENTA,
+    "PRICE": FG_BLUE + BOLD,
+    "HOLD": FG_CYAN,
+    "BUY": FG_GREEN + BOLD,
+    "SELL": FG_YELLOW + BOLD,
+    "COOLDOWN": FG_YELLOW,
+    "SKIP": FG_YELLOW,
+    "NO": FG_WHITE + DIM,        # [NO TRADES]
+    "WARMUP": FG_WHITE + DIM,
+}
+_COLOR_ERROR = FG_RED + BOLD
+_COLOR_WARN = FG_YELLOW + DIM
+
+
+def _log_tag(msg: str) -> str:
+    if not msg.startswith("["):
+        return ""
+    end = msg.find("]")
+    if end < 0:
+        return ""
+    return msg[1:end].split(" ", 1)[0]
+
+
+def color_for(msg: str) -> str:
+    """
+    เลือกสีตามประเภท log จาก tag ใน [..] (lookup dict ครั้งเดียว) / keyword ในข้อความ
+    ปรับ mapping ได้ที่ _COLOR_MAP
+    """
+    # ERROR / EXCEPTION
+    if "ERROR" in msg or "EXC" in msg:
+        return _COLOR_ERROR
+
+    color = _COLOR_MAP.get(_log_tag(msg))
+    if color is not None:
+        return color
+
+    # WARN
+    if "WARN" in msg:
+        return _COLOR_WARN
+
+    # DEFAULT
+    return FG_WHITE
+
+
+# ------------------------------------------------------------
+# LOGGING
+# ------------------------------------------------------------
+class ColorFormatter(logging.Formatter):
+    """
+    ใส่เวลา server + สีตามประเภท log (ใส่สีเฉพาะเมื่อ use_color)
+    เวลาคิดจาก record.created (ตอน log ถูกเรียก) + offset_ms() ไม่ใช่ตอน QueueListener เขียนออก
+    """
+
+    def __init__(self, use_color: bool, offset_ms: Optional[Callable[[], int]] = None):
+        super().__init__()
+        self.use_color = use_color
+        self.offset_ms = offset_ms
+
+    def format(self, record: logging.LogRecord) -> str:
+        msg = record.getMessage()
+        created = record.created
+        if self.offset_ms is not None:
+            created += self.offset_ms() / 1000
+        ts = f"{datetime.datetime.fromtimestamp(created):%Y-%m-%d %H:%M:%S}"
+        if not self.use_color:
+            return f"[{ts}] {msg}"
+        return f"{DIM}[{ts}]{RESET} {color_for(msg)}{msg}{RESET}"
+
+
+def make_logger(name: str, level: int, use_color: Optional[bool] = None,
+                offset_ms: Optional[Callable[[], int]] = None) -> logging.Logger:
+    """
+    logger ที่ loop หลักแค่ put record ลง queue; thread ของ QueueListener เป็นคน format + เขียน stdout
+    use_color=None -> ใส่สีเฉพาะตอน stdout เป็น terminal
+    offset_ms: ฟังก์ชันคืน offset เวลา server - local (ms) ใช้ตอนใส่เวลาใน log
+    """
+    logger = logging.getLogger(name)
+    logger.setLevel(level)
+    if logger.handlers:   # เรียกซ้ำชื่อเดิม -> ใช้ตัวที่ตั้งไว้แล้ว ไม่ซ้อน handler
+        return logger
+    logger.propagate = False
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(ColorFormatter(sys.stdout.isatty() if use_color is None else use_color, offset_ms))
+    log_queue: "queue.Queue[logging.LogRecord]" = queue.Queue(-1)
+    listener = logging.handlers.QueueListener(log_queue, handler)
+    listener.start()
+    atexit.register(listener.stop)   # stop() รอเขียน record ที่ยังค้างใน queue ให้หมดก่อนจบโปรแกรม
+    logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    return logger
+
+
+# ------------------------------------------------------------
+# JSON (orjson ถ้ามี)
+# ------------------------------------------------------------
+def json_loads(raw: bytes) -> Any:
+    return orjson.loads(raw) if orjson is not None else json.loads(raw)
+
+
+def json_dumps(obj) -> bytes:
+    """JSON แบบไม่มีช่องว่าง เป็น bytes (พร้อมส่งเป็น body)"""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(",", ":")).encode()
+
+
+# ------------------------------------------------------------
+# NUMBA
+# ------------------------------------------------------------
+def njit(*args, **kwargs):
+    """
+    numba.njit ถ้ามี numba ไม่มีก็คืนฟังก์ชันเดิม (ยังรันได้ แค่ช้ากว่า)
+    import numba ตอนใช้ครั้งแรก -> bot ที่ไม่มี kernel ไม่ต้องเสียเวลาโหลด numba
+    """
+    try:
+        from numba import njit as numba_njit
+    except ImportError:
+        if args and callable(args[0]):
+            return args[0]
+        return lambda fn: fn
+    return numba_njit(*args, **kwargs)
+
+
+# ------------------------------------------------------------
+# HTTP SESSION
+# ------------------------------------------------------------
+def make_session(pool_connections: int = 4, pool_maxsize: int = 8) -> requests.Session:
+    """
+    requests.Session สำหรับ api.bitkub.com
+    pool ขนาดพอดีกับ host เดียว; retry ให้ http_get/http_post ของแต่ละ bot ทำเอง -> max_retries=0
+    """
+    session = requests.Session()
+    session.mount("https://", HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, max_retries=0))
+    return session
+
+
+# ------------------------------------------------------------
+# AUTH (v3 sign)
+# ------------------------------------------------------------
+class BitkubSigner:
+    """
+    sign = HMAC_SHA256( timestamp + method + requestPath + body ) + header ที่ต้องแนบ
+    key schedule ของ HMAC (ipad/opad) ทำครั้งเดียวตอนสร้าง ต่อ request แค่ copy() แล้ว update
+    """
+
+    def __init__(self, api_key: str, api_secret: bytes):
+        self._hmac = hmac.new(api_secret, None, hashlib.sha256)
+        # header ส่วนที่เหมือนกันทุก request ที่ต้อง sign
+        self._base_headers = {
+            "Accept": "application/json",
+            "Content-Type": "application/json",
+            "X-BTK-APIKEY": api_key,
+        }
+
+    def sign(self, timestamp_ms: str, method: str, request_path: str, body: str = "") -> str:
+        return self.sign_bytes(timestamp_ms, (method.upper() + request_path).encode(), (body or "").encode())
+
+    def sign_bytes(self, timestamp_ms: str, method_path: bytes, body: bytes) -> str:
+        """sign แบบรับ method+path ที่ encode ไว้แล้ว (ค่าคงที่ต่อ endpoint) และ body เป็น bytes"""
+        h = self._hmac.copy()
+        h.update(timestamp_ms.encode())
+        h.update(method_path)
+        h.update(body)
+        return h.hexdigest()
+
+    def build_headers(self, timestamp_ms: str, signature: Optional[str] = None) -> Dict[str, str]:
+        if signature:
+            return {**self._base_headers, "X-BTK-TIMESTAMP": timestamp_ms, "X-BTK-SIGN": signature}
+        return {**self._base_headers, "X-BTK-TIMESTAMP": timestamp_ms}
@@ -1,17 +1,44 @@
+import sys
 import time
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import pandas as pd
-import pandas_ta as ta
-import psutil
 import os
 import numpy as np
 import json
-from tabulate import tabulate
+import threading
+import asyncio
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from typing import Optional
+
+try:
+    import aiohttp
+except ImportError:  # ไม่มี aiohttp ก็ดึงด้วย thread pool แทน
+    aiohttp = None
+
+from Strategy.bitkub_common import json_loads, njit
 
 pd.set_option('display.max_rows', None)
 
 BITKUB_TV_URL = "https://api.bitkub.com/tradingview/history"
 
+# retry policy เดียวกันทั้ง requests session และ aiohttp (_fetch_ohlcv_async)
+RETRY_TOTAL = 3
+RETRY_BACKOFF = 0.3
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+# session เดียวใช้ร่วมกันทุก thread -> reuse TCP/TLS connection ไป api.bitkub.com
+session = requests.Session()
+session.mount(
+    "https://",
+    HTTPAdapter(
+        pool_connections=32,
+        pool_maxsize=32,
+        max_retries=Retry(total=RETRY_TOTAL, backoff_factor=RETRY_BACKOFF, status_forcelist=list(RETRY_STATUS)),
+    ),
+)
+
 currency = ["XRP_THB", "BTC_THB", "ETH_THB", "USDT_THB", "SOL_THB", "ADA_THB", "BNB_THB"]
 
 timeframes = {
@@ -24,10 +51,30 @@ timeframes = {
     "1d": "1D",
 }
 
+
+def _resolution_step_sec(resolution: str) -> int:
+    """
+    แปลง resolution ("5","60","1D",...) เป็นจำนวนวินาทีต่อแท่ง
+    """
+    if resolution.upper().endswith("D"):
+        num_days = int(resolution[:-1]) if len(resolution) > 1 else 1
+        return num_days * 24 * 60 * 60
+    return int(resolution) * 60
+
+
+# ตารางวินาทีต่อแท่งของทุก timeframe (parse ครั้งเดียวตอน import -> resolution ผิดจะ error ตั้งแต่ตอนนี้)
+_STEP_SEC = {res: _resolution_step_sec(res) for res in timeframes.values()}
+
 with open("config/color.json", "r", encoding="utf-8") as f:
     COLORS = json.load(f)
 
 
+# template สีของแต่ละ trend สร้างครั้งเดียวตอนโหลด ("{}" = ตัวข้อความ)
+_RESET = COLORS.get("RESET", "")
+_COLORED = {k: f"{v}{{}}{_RESET}" for k, v in COLORS.items() if k != "RESET"}
+_ERROR_COLORED = f"{COLORS.get('DOWN', '')}{{}}{_RESET}"
+
+
 def color_trend(val: str) -> str:
     if val is None:
         return "-"
@@ -35,150 +82,486 @@ def color_trend(val: str) -> str:
 
     # ถ้าเป็น error ให้ใช้สี DOWN
     if text.startswith("ERROR"):
-        return f"{COLORS.get('DOWN', '')}{text}{COLORS.get('RESET', '')}"
+        return _ERROR_COLORED.format(text)
 
     # ถ้า text ตรงกับ key สีในไฟล์ config
-    if text in COLORS:
-        return f"{COLORS[text]}{text}{COLORS.get('RESET', '')}"
+    return _COLORED.get(text, "{}").format(text)
 
-    return text
+
+def _fmt_num(x):
+    if x is None or x != x:   # None / NaN
+        return "-"
+    try:
+        return round(float(x), 4)
+    except Exception:
+        return x
 
 
 def print_pretty_table(df: pd.DataFrame):
     """
     แสดงทุกคอลัมน์ + ใส่สี trend + format atr/tp ไม่ให้เห็น NaN ตรง ๆ
+    (format ลง list ของ dict ใหม่ ไม่ copy ทั้ง df)
     """
-    df_fmt = df.copy()
+    from tabulate import tabulate  # ใช้เฉพาะตอนแสดงผล ไม่ต้องโหลดตอน import
 
-    # ใส่สี trend ถ้ามี
-    if "trend" in df_fmt.columns:
-        df_fmt["trend"] = df_fmt["trend"].apply(color_trend)
+    rows = df.to_dict("records")
+    num_cols = [col for col in ("atr", "tp1", "tp2") if col in df.columns]
+    has_trend = "trend" in df.columns
 
-    # จัดการ NaN ในคอลัมน์ atr / tp1 / tp2 แปลงให้เป็น "-" ตอนแสดงผล
-    for col in ["atr", "tp1", "tp2"]:
-        if col in df_fmt.columns:
-            def _fmt(x):
-                if pd.isna(x):
-                    return "-"
-                try:
-                    return round(float(x), 4)
-                except Exception:
-                    return x
-            df_fmt[col] = df_fmt[col].apply(_fmt)
+    for r in rows:
+        # ใส่สี trend ถ้ามี
+        if has_trend:
+            r["trend"] = color_trend(r["trend"])
+        # จัดการ NaN ในคอลัมน์ atr / tp1 / tp2 แปลงให้เป็น "-" ตอนแสดงผล
+        for col in num_cols:
+            r[col] = _fmt_num(r[col])
 
-    print(tabulate(df_fmt, headers="keys", tablefmt="grid", showindex=False))
+    print(tabulate(rows, headers="keys", tablefmt="grid"))
 
 
-def fetch_ohlcv(symbol: str, resolution: str, bars: int = 300) -> pd.DataFrame:
+# kernel ทุกตัวให้ผลเท่ากับ pandas_ta (สูตร pure-python ไม่ใช่ TA-Lib) ที่ใช้อยู่เดิม -> เช็คได้ด้วย check_parity()
+@njit(cache=True)
+def _ema_nb(x, length):
     """
-    ดึง OHLCV จาก Bitkub TradingView API
-    resolution เช่น "5","15","60","240","1D"
+    EMA แบบ ta.ema: seed ด้วย SMA ของ length แท่งแรก แล้ว ewm(span=length, adjust=False)
     """
-    # แปลง resolution เป็นจำนวนวินาทีต่อแท่ง
-    if resolution.upper().endswith("D"):
-        num_days = int(resolution[:-1]) if len(resolution) > 1 else 1
-        step_sec = num_days * 24 * 60 * 60
+    n = x.shape[0]
+    out = np.full(n, np.nan)
+    if n < length:
+        return out
+    a = 2.0 / (length + 1)
+    s = 0.0
+    for i in range(length):
+        s += x[i]
+    v = s / length
+    out[length - 1] = v
+    for i in range(length, n):
+        v = a * x[i] + (1.0 - a) * v
+        out[i] = v
+    return out
+
+
+@njit(cache=True)
+def _rma_nb(x, length):
+    """
+    RMA แบบ ta.rma = x.ewm(alpha=1/length, min_periods=length).mean() (adjust=True)
+    NaN ไม่นับเป็นจุดข้อมูลแต่ยังลดน้ำหนักค่าเก่า เหมือน pandas (ignore_na=False)
+    """
+    n = x.shape[0]
+    out = np.full(n, np.nan)
+    decay = 1.0 - 1.0 / length
+    avg = np.nan
+    old_wt = 1.0
+    nobs = 0
+    for i in range(n):
+        cur = x[i]
+        is_obs = cur == cur
+        if is_obs:
+            nobs += 1
+        if avg == avg:
+            old_wt *= decay
+            if is_obs:
+                if avg != cur:
+                    avg = (old_wt * avg + cur) / (old_wt + 1.0)
+                old_wt += 1.0
+        elif is_obs:
+            avg = cur
+        if nobs >= length:
+            out[i] = avg
+    return out
+
+
+@njit(cache=True)
+def _true_range_nb(h, l, c):
+    n = c.shape[0]
+    out = np.full(n, np.nan)
+    for i in range(1, n):
+        out[i] = max(abs(h[i] - l[i]), abs(h[i] - c[i - 1]), abs(l[i] - c[i - 1]))
+    return out
+
+
+@njit(cache=True, error_model="numpy")
+def _adx_nb(h, l, tr, length):
+    """
+    ADX แบบ ta.adx (ATR / +DM / -DM / DX ใช้ rma ทั้งหมด)
+    error_model numpy -> หาร 0 ได้ NaN/inf เหมือน pandas แทนที่จะ raise
+    """
+    n = h.shape[0]
+    pos = np.full(n, np.nan)
+    neg = np.full(n, np.nan)
+    eps = 2.220446049250313e-16   # ta.adx ปัดค่าที่เล็กกว่า epsilon เป็น 0
+    for i in range(1, n):
+        up = h[i] - h[i - 1]
+        dn = l[i - 1] - l[i]
+        p = up if (up > dn and up > 0.0) else 0.0
+        m = dn if (dn > up and dn > 0.0) else 0.0
+        pos[i] = 0.0 if abs(p) < eps else p
+        neg[i] = 0.0 if abs(m) < eps else m
+    k = 100.0 / _rma_nb(tr, length)
+    dmp = k * _rma_nb(pos, length)
+    dmn = k * _rma_nb(neg, length)
+    dx = 100.0 * np.abs(dmp - dmn) / (dmp + dmn)
+    return _rma_nb(dx, length)
+
+
+@njit(cache=True)
+def _supertrend_nb(h, l, c, atr, mult):
+    """
+    Supertrend แบบ ta.supertrend: band เลื่อนได้ทางเดียวตามทิศเดิม, กลับทิศเมื่อ close ทะลุ band ของแท่งก่อน
+    atr: ATR (rma) ของ length ที่ใช้
+    return: (supertrend, direction) ช่วง warmup supertrend เป็น NaN
+    """
+    n = c.shape[0]
+    st = np.full(n, np.nan)
+    direction = np.ones(n)
+    if n == 0:
+        return st, direction
+    upper_prev = (h[0] + l[0]) / 2.0 + mult * atr[0]
+    lower_prev = (h[0] + l[0]) / 2.0 - mult * atr[0]
+    for i in range(1, n):
+        hl2 = (h[i] + l[i]) / 2.0
+        upper = hl2 + mult * atr[i]
+        lower = hl2 - mult * atr[i]
+        if c[i] > upper_prev:
+            direction[i] = 1.0
+        elif c[i] < lower_prev:
+            direction[i] = -1.0
+        else:
+            direction[i] = direction[i - 1]
+            if direction[i] > 0 and lower < lower_prev:
+                lower = lower_prev
+            if direction[i] < 0 and upper > upper_prev:
+                upper = upper_prev
+        st[i] = lower if direction[i] > 0 else upper
+        upper_prev = upper
+        lower_prev = lower
+    return st, direction
+
+
+def _indicators(df: pd.DataFrame, fast: int, slow: int, adx_len: int, super_len: int, super_mult: float) -> dict:
+    """
+    indicator ทั้งชุดของ detect_trend เป็น array ยาวเท่า df (NaN ช่วง warmup)
+    """
+    h = df["high"].to_numpy(dtype=np.float64)
+    l = df["low"].to_numpy(dtype=np.float64)
+    c = df["close"].to_numpy(dtype=np.float64)
+    tr = _true_range_nb(h, l, c)
+    atr = _rma_nb(tr, 14)
+    st_atr = atr if super_len == 14 else _rma_nb(tr, super_len)
+    st, st_dir = _supertrend_nb(h, l, c, st_atr, float(super_mult))
+    return {
+        "ema_fast": _ema_nb(c, fast),
+        "ema_slow": _ema_nb(c, slow),
+        "adx": _adx_nb(h, l, tr, adx_len),
+        "supertrend": st,
+        "supertrend_dir": st_dir,
+        "atr": atr,
+    }
+
+
+def check_parity(
+    df: pd.DataFrame,
+    fast: int = 20,
+    slow: int = 50,
+    adx_len: int = 14,
+    super_len: int = 10,
+    super_mult: float = 3.0,
+) -> dict:
+    """
+    เทียบ indicator จาก kernel กับ pandas_ta (วิธีเดิม) บน df เดียวกัน (ต้องติดตั้ง pandas_ta)
+    return: {indicator: relative diff สูงสุด}, ตำแหน่ง NaN ไม่ตรงกัน = inf
+    """
+    import pandas_ta as ta
+
+    high = df["high"].astype(np.float64)
+    low = df["low"].astype(np.float64)
+    close = df["close"].astype(np.float64)
+    st = ta.supertrend(high, low, close, length=super_len, multiplier=super_mult, talib=False)
+    st_price = st[[c for c in st.columns if c.startswith("SUPERT_")][0]].to_numpy(dtype=np.float64)
+    st_dir = st[[c for c in st.columns if c.startswith("SUPERTd_")][0]].to_numpy(dtype=np.float64)
+    ref = {
+        "ema_fast": ta.ema(close, length=fast, talib=False).to_numpy(dtype=np.float64),
+        "ema_slow": ta.ema(close, length=slow, talib=False).to_numpy(dtype=np.float64),
+        "adx": ta.adx(high, low, close, length=adx_len, talib=False)[f"ADX_{adx_len}"].to_numpy(dtype=np.float64),
+        "supertrend": st_price,
+        "supertrend_dir": np.where(np.isnan(st_price), np.nan, st_dir),
+        "atr": ta.atr(high, low, close, length=14, talib=False).to_numpy(dtype=np.float64),
+    }
+
+    got = _indicators(df, fast, slow, adx_len, super_len, super_mult)
+    got["supertrend_dir"] = np.where(np.isnan(got["supertrend"]), np.nan, got["supertrend_dir"])
+
+    out = {}
+    for name, want in ref.items():
+        # แท่งแรก ta.supertrend ใส่ 0 แทน NaN -> เทียบตั้งแต่แท่งที่ 2
+        a, b = got[name][1:], want[1:]
+        if not np.array_equal(np.isnan(a), np.isnan(b)):
+            out[name] = np.inf
+            continue
+        ok = ~np.isnan(b)
+        out[name] = float(np.max(np.abs(a[ok] - b[ok]) / np.maximum(np.abs(b[ok]), 1e-12), initial=0.0))
+    return out
+
+
+def ts_to_bkk(ts) -> pd.Timestamp:
+    """
+    แปลง unix ts (วินาที, UTC) -> เวลาไทยแบบไม่มี tz (ใช้ตอนแสดงผล)
+    """
+    return pd.Timestamp(int(ts), unit="s", tz="UTC").tz_convert("Asia/Bangkok").tz_localize(None)
+
+
+# cache OHLCV key = (symbol, resolution) -> {"last_ts", "bars", "etag", "df"}
+# ทุกครั้งยังยิง API (แท่งล่าสุดยังไม่ปิด close/high/low เปลี่ยนได้ตลอด)
+# แต่ขอเฉพาะช่วงท้ายตั้งแต่แท่งก่อนแท่งล่าสุดที่มี แล้วต่อกับ df เดิม
+# df ใน cache ใช้ร่วมกัน ห้ามแก้ค่าในที่
+_OHLCV_CACHE = {}
+_OHLCV_CACHE_LOCK = threading.Lock()
+
+# request ที่กำลังยิงอยู่ key = (symbol, resolution, bars) -> Future
+# ถ้ามีคนขอ key เดียวกันซ้อนกัน ให้รอผลจาก request เดิมแทนการยิงใหม่
+_INFLIGHT = {}
+_INFLIGHT_LOCK = threading.Lock()
+
+
+def _inflight_claim(key):
+    """
+    return: (future, owner) owner=True แปลว่าเป็นคนยิง request เอง
+    """
+    with _INFLIGHT_LOCK:
+        fut = _INFLIGHT.get(key)
+        if fut is not None:
+            return fut, False
+        fut = Future()
+        _INFLIGHT[key] = fut
+        return fut, True
+
+
+def _inflight_done(key, fut: Future, df=None, exc=None):
+    with _INFLIGHT_LOCK:
+        _INFLIGHT.pop(key, None)
+    if exc is not None:
+        fut.set_exception(exc)
     else:
-        step_min = int(resolution)
-        step_sec = step_min * 60
+        fut.set_result(df)
+
+
+def _ohlcv_plan(symbol: str, resolution: str, bars: int):
+    """
+    เตรียม request ของ fetch_ohlcv (ใช้ร่วมกันทั้งแบบ sync / async)
+    """
+    # แปลง resolution เป็นจำนวนวินาทีต่อแท่ง
+    step_sec = _STEP_SEC.get(resolution) or _resolution_step_sec(resolution)
 
     now = int(time.time())
     to_ts = now
     from_ts = now - bars * step_sec
 
+    key = (symbol, resolution)
+    with _OHLCV_CACHE_LOCK:
+        cached = _OHLCV_CACHE.get(key)
+    if cached is not None and cached["bars"] != bars:
+        cached = None
+    if cached is not None:
+        # ขอย้อนไป 1 แท่ง เผื่อแท่งล่าสุดรอบก่อนยังไม่ปิด
+        from_ts = max(from_ts, cached["last_ts"] - step_sec)
+
     params = {
         "symbol": symbol,
         "resolution": resolution,
         "from": from_ts,
         "to": to_ts,
     }
+    # conditional GET ถ้า server เคยส่ง ETag มา
+    headers = {"If-None-Match": cached["etag"]} if cached is not None and cached["etag"] else {}
+    return {
+        "key": key,
+        "cached": cached,
+        "params": params,
+        "headers": headers,
+        "bars": bars,
+    }
+
+
+def _ohlcv_build(plan: dict, status: int, raw: bytes, etag: Optional[str]) -> pd.DataFrame:
+    """
+    แปลง response จาก API เป็น df ต่อท้าย cache เดิม แล้วอัปเดต cache
+    ถ้าได้ 304 -> ใช้ df เดิม ไม่ต้อง parse / สร้าง df ใหม่
+    """
+    symbol, resolution = plan["key"]
+    cached = plan["cached"]
+    bars = plan["bars"]
 
-    r = requests.get(BITKUB_TV_URL, params=params, timeout=10)
-    r.raise_for_status()
-    data = r.json()
+    if cached is not None and status == 304:
+        return cached["df"]
 
+    data = json_loads(raw)
     if data.get("s") != "ok":
         raise ValueError(f"Bitkub returned non-ok status for {symbol} {resolution}: {data}")
 
-    df = pd.DataFrame(
-        {
-            # แปลงจาก UTC -> เวลาไทย
-            "time": pd.to_datetime(pd.Series(data["t"]), unit="s", utc=True).dt.tz_convert("Asia/Bangkok").dt.tz_localize(None),
-            "open": data["o"],
-            "high": data["h"],
-            "low": data["l"],
-            "close": data["c"],
-            "volume": data["v"],
-        }
-    )
+    # ราคาต้องเป็น float64 (BTC_THB หลักล้าน float32 ละเอียดได้แค่ ~0.25 THB)
+    t = np.asarray(data["t"], dtype=np.int64)
+    cols = {
+        "open": np.asarray(data["o"], dtype=np.float64),
+        "high": np.asarray(data["h"], dtype=np.float64),
+        "low": np.asarray(data["l"], dtype=np.float64),
+        "close": np.asarray(data["c"], dtype=np.float64),
+        "volume": np.asarray(data["v"], dtype=np.float64),
+    }
+
+    # ปกติ API ส่งมาเรียงแล้ว ถ้าไม่เรียงค่อย argsort ครั้งเดียวก่อนสร้าง df
+    if t.size > 1 and not np.all(t[1:] >= t[:-1]):
+        order = np.argsort(t, kind="stable")
+        t = t[order]
+        cols = {k: v[order] for k, v in cols.items()}
+
+    # เก็บเป็น unix ts (int64) ไว้ก่อน แปลงเป็นเวลาไทยเฉพาะตอนแสดงผล
+    df = pd.DataFrame({"ts": t, **cols}, copy=False)
+
+    if cached is not None:
+        df = pd.concat([cached["df"], df], ignore_index=True)
+        df = df.drop_duplicates("ts", keep="last").tail(bars).reset_index(drop=True)
+
+    if t.size:
+        with _OHLCV_CACHE_LOCK:
+            _OHLCV_CACHE[plan["key"]] = {
+                "last_ts": int(t[-1]),
+                "bars": bars,
+                "etag": etag,
+                "df": df,
+            }
+    return df
+
+
+def fetch_ohlcv(symbol: str, resolution: str, bars: int = 300) -> pd.DataFrame:
+    """
+    ดึง OHLCV จาก Bitkub TradingView API
+    resolution เช่น "5","15","60","240","1D"
+    ถ้าเคยดึงคู่/ไทม์เฟรมนี้แล้ว จะขอเฉพาะช่วงตั้งแต่แท่งก่อนแท่งล่าสุดที่มีแล้วต่อท้าย cache
+    """
+    plan = _ohlcv_plan(symbol, resolution, bars)
+
+    key = (symbol, resolution, bars)
+    fut, owner = _inflight_claim(key)
+    if not owner:
+        return fut.result()
+
+    try:
+        r = session.get(BITKUB_TV_URL, params=plan["params"], headers=plan["headers"], timeout=10)
+        r.raise_for_status()
+        df = _ohlcv_build(plan, r.status_code, r.content, r.headers.get("ETag"))
+    except Exception as e:
+        _inflight_done(key, fut, exc=e)
+        raise
+    _inflight_done(key, fut, df)
+    return df
 
-    # กันเหนียว เผื่อ API ส่งลำดับผิด
-    df = df.sort_values("time").reset_index(drop=True)
 
+def _retry_delay(attempt: int, retry_after: Optional[str] = None) -> float:
+    """
+    เวลารอก่อน retry ครั้งที่ attempt+1 แบบเดียวกับ urllib3 Retry
+    (ครั้งแรกไม่รอ แล้ว backoff_factor * 2^n, ถ้า server ส่ง Retry-After มาใช้ค่านั้น)
+    """
+    if retry_after:
+        try:
+            return max(float(retry_after), 0.0)
+        except ValueError:
+            pass
+    return 0.0 if attempt == 0 else RETRY_BACKOFF * (2 ** attempt)
+
+
+async def _fetch_ohlcv_async(http, symbol: str, resolution: str, bars: int = 300) -> pd.DataFrame:
+    """
+    fetch_ohlcv แบบ async (aiohttp) ใช้ cache ชุดเดียวกัน
+    retry 5xx/429 และ connection error ตาม RETRY_* เหมือน session ของ requests
+    """
+    plan = _ohlcv_plan(symbol, resolution, bars)
+
+    key = (symbol, resolution, bars)
+    fut, owner = _inflight_claim(key)
+    if not owner:
+        return await asyncio.wrap_future(fut)
+
+    try:
+        for attempt in range(RETRY_TOTAL + 1):
+            last_try = attempt == RETRY_TOTAL
+            try:
+                async with http.get(BITKUB_TV_URL, params=plan["params"], headers=plan["headers"]) as r:
+                    if r.status in RETRY_STATUS and not last_try:
+                        delay = _retry_delay(attempt, r.headers.get("Retry-After"))
+                    else:
+                        r.raise_for_status()
+                        raw = await r.read()
+                        status, etag = r.status, r.headers.get("ETag")
+                        break
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                if last_try:
+                    raise
+                delay = _retry_delay(attempt)
+            await asyncio.sleep(delay)
+        df = _ohlcv_build(plan, status, raw, etag)
+    except Exception as e:
+        _inflight_done(key, fut, exc=e)
+        raise
+    _inflight_done(key, fut, df)
     return df
 
 
-def detect_trend(
+async def _fetch_all_async(keys, bars: int, limit: int) -> list:
+    """
+    ดึงทุก (symbol, resolution) ใน event loop เดียว, คืน list ของ df หรือ Exception ตามลำดับ keys
+    """
+    connector = aiohttp.TCPConnector(limit=limit, ttl_dns_cache=300)
+    timeout = aiohttp.ClientTimeout(total=10)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as http:
+        return await asyncio.gather(
+            *(_fetch_ohlcv_async(http, sym, res, bars) for sym, res in keys),
+            return_exceptions=True,
+        )
+
+
+def _last_bar(df: pd.DataFrame) -> dict:
+    """
+    ค่าของแท่งสุดท้าย (time เป็นเวลาไทย) + ช่อง indicator เป็น NaN, df ว่างได้ทุกช่องเป็น NaN/NaT
+    """
+    last = {"time": pd.NaT, "open": np.nan, "high": np.nan, "low": np.nan, "close": np.nan, "volume": np.nan}
+    if len(df):
+        if "ts" in df.columns:
+            last["ts"] = int(df["ts"].iat[-1])
+            last["time"] = ts_to_bkk(last["ts"])
+        else:   # df รูปแบบเดิมที่มีคอลัมน์ time อยู่แล้ว
+            last["time"] = df["time"].iat[-1]
+        for col in ("open", "high", "low", "close", "volume"):
+            last[col] = float(df[col].iat[-1])
+    for col in ("ema_fast", "ema_slow", "adx", "supertrend", "supertrend_dir", "atr", "tp1", "tp2"):
+        last[col] = np.nan
+    return last
+
+
+def _trend_last(
     df: pd.DataFrame,
-    fast: int = 50,
-    slow: int = 200,
-    adx_len: int = 14,
-    adx_threshold: float = 20.0,
-    super_len: int = 10,
-    super_mult: float = 3.0,
+    fast: int,
+    slow: int,
+    adx_len: int,
+    adx_threshold: float,
+    super_len: int,
+    super_mult: float,
 ):
     """
-    ระบุเทรนด์จาก EMA(เร็ว/ช้า) + ADX + Supertrend + ATR และคำนวณ TP1/TP2
+    ตัวคำนวณของ detect_trend คืน last เป็น dict (ตารางใน build_trend_table ใช้ตัวนี้ ไม่ต้องสร้าง Series)
     """
-    df = df.copy()
+    # ไม่ copy df (df มาจาก cache ใช้ร่วมกัน) -> ดึง ndarray ออกมาคำนวณแล้วเก็บแค่ค่าท้ายเป็น dict
+    last = _last_bar(df)
 
     # ถ้าแท่งไม่พอคำนวณ indicator ให้ UNKNOWN ไปก่อน
     if len(df) < max(slow, adx_len + 1, super_len + 1):
-        last = df.iloc[-1].copy()
-        last["ema_fast"] = np.nan
-        last["ema_slow"] = np.nan
-        last["adx"] = np.nan
-        last["supertrend"] = np.nan
-        last["supertrend_dir"] = np.nan
-        last["atr"] = np.nan
-        last["tp1"] = np.nan
-        last["tp2"] = np.nan
         return "UNKNOWN", last
 
-    # EMA
-    df["ema_fast"] = ta.ema(df["close"], length=fast)
-    df["ema_slow"] = ta.ema(df["close"], length=slow)
-
-    # ADX
-    adx = ta.adx(df["high"], df["low"], df["close"], length=adx_len)
-    adx_col = f"ADX_{adx_len}"
-    df["adx"] = adx[adx_col]
-
-    # Supertrend
-    st = ta.supertrend(
-        df["high"],
-        df["low"],
-        df["close"],
-        length=super_len,
-        multiplier=super_mult,
-    )
-    # pandas_ta.supertrend คืนคอลัมน์ประมาณ: SUPERT_10_3.0, SUPERTd_10_3.0, ...
-    st_price_col = [c for c in st.columns if c.startswith("SUPERT_")][0]
-    st_dir_col = [c for c in st.columns if c.startswith("SUPERTd_")][0]
-
-    df["supertrend"] = st[st_price_col]
-    df["supertrend_dir"] = st[st_dir_col]
-
-    # ATR
-    df["atr"] = ta.atr(df["high"], df["low"], df["close"], length=14)
-
-    last = df.iloc[-1].copy()
+    for k, v in _indicators(df, fast, slow, adx_len, super_len, super_mult).items():
+        last[k] = float(v[-1])
 
     # ถ้า indicator ตัวใดตัวหนึ่งในชุดนี้ยังเป็น NaN ให้ถือว่าไม่พร้อมใช้
-    required_cols = ["ema_fast", "ema_slow", "adx", "supertrend", "supertrend_dir", "atr"]
-    if df[required_cols].iloc[-1].isna().any():
-        last["tp1"] = np.nan
-        last["tp2"] = np.nan
+    required_cols = ("ema_fast", "ema_slow", "adx", "supertrend", "supertrend_dir", "atr")
+    if any(v != v for v in (last[k] for k in required_cols)):
         return "UNKNOWN", last
 
     # คำนวณเทรนด์
@@ -209,6 +592,78 @@ def detect_trend(
     return trend, last
 
 
+def detect_trend(
+    df: pd.DataFrame,
+    fast: int = 50,
+    slow: int = 200,
+    adx_len: int = 14,
+    adx_threshold: float = 20.0,
+    super_len: int = 10,
+    super_mult: float = 3.0,
+):
+    """
+    ระบุเทรนด์จาก EMA(เร็ว/ช้า) + ADX + Supertrend + ATR และคำนวณ TP1/TP2
+    return: (trend, last) last เป็น pd.Series ของแท่งสุดท้าย (time, OHLCV, indicator, tp1/tp2)
+    df ว่าง / แท่งไม่พอ -> ("UNKNOWN", last ที่ indicator เป็น NaN)
+    """
+    trend, last = _trend_last(df, fast, slow, adx_len, adx_threshold, super_len, super_mult)
+    return trend, pd.Series(last, dtype=object)
+
+
+# คอลัมน์ตัวเลขของตาราง (แถวที่ error จะเป็น NaN)
+_TABLE_FLOAT_COLS = ("close", "ema_fast", "ema_slow", "adx", "supertrend", "supertrend_dir", "atr", "tp1", "tp2")
+
+
+def _trend_row(
+    sym: str,
+    tf_label: str,
+    df: pd.DataFrame,
+    fast: int,
+    slow: int,
+    adx_len: int,
+    adx_threshold: float,
+    super_len: int,
+    super_mult: float,
+) -> tuple:
+    """
+    คำนวณเทรนด์ของ (symbol, timeframe) 1 ชุด แล้วคืนเป็นแถวของตาราง
+    """
+    trend, last = _trend_last(df, fast, slow, adx_len, adx_threshold, super_len, super_mult)
+
+    # เรียงตามคอลัมน์ของตาราง: (last_time, ค่าตาม _TABLE_FLOAT_COLS, trend, bars_count)
+    return (
+        last["time"].to_datetime64(),
+        tuple(last[col] for col in _TABLE_FLOAT_COLS),
+        trend,
+        len(df),
+    )
+
+
+def _alloc_table(n: int) -> dict:
+    """
+    จองคอลัมน์ของตารางเป็น numpy array ชนิดตายตัว (ไม่ให้ pandas ต้องเดา dtype จาก list ของ dict)
+    """
+    cols = {
+        "symbol": np.empty(n, dtype=object),
+        "timeframe": np.empty(n, dtype=object),
+        "last_time": np.full(n, np.datetime64("NaT"), dtype="datetime64[ns]"),
+    }
+    for col in _TABLE_FLOAT_COLS:
+        cols[col] = np.full(n, np.nan)
+    cols["trend"] = np.empty(n, dtype=object)
+    cols["bars_count"] = np.zeros(n, dtype=np.int64)
+    return cols
+
+
+def _fill_row(cols: dict, i: int, row: tuple):
+    last_time, values, trend, bars_count = row
+    cols["last_time"][i] = last_time
+    for col, v in zip(_TABLE_FLOAT_COLS, values):
+        cols[col][i] = v
+    cols["trend"][i] = trend
+    cols["bars_count"][i] = bars_count
+
+
 def build_trend_table(
     symbols,
     timeframes_dict,
@@ -219,63 +674,73 @@ def build_trend_table(
     adx_threshold: float = 20.0,
     super_len: int = 10,
     super_mult: float = 3.0,
+    fetch_workers: int = 16,
 ) -> pd.DataFrame:
-    rows = []
-
-    for sym in symbols:
-        for tf_label, res in timeframes_dict.items():
-            try:
-                df = fetch_ohlcv(sym, res, bars=bars)
-                trend, last = detect_trend(
-                    df,
-                    fast=fast,
-                    slow=slow,
-                    adx_len=adx_len,
-                    adx_threshold=adx_threshold,
-                    super_len=super_len,
-                    super_mult=super_mult,
-                )
-
-                rows.append(
-                    {
-                        "symbol": sym,
-                        "timeframe": tf_label,
-                        "last_time": last["time"],
-                        "close": float(last["close"]),
-                        "ema_fast": last.get("ema_fast", np.nan),
-                        "ema_slow": last.get("ema_slow", np.nan),
-                        "adx": last.get("adx", np.nan),
-                        "supertrend": last.get("supertrend", np.nan),
-                        "supertrend_dir": last.get("supertrend_dir", np.nan),
-                        "atr": last.get("atr", np.nan),
-                        "tp1": last.get("tp1", np.nan),
-                        "tp2": last.get("tp2", np.nan),
-                        "trend": trend,
-                        "bars_count": len(df),
-                    }
-                )
-            except Exception as e:
-                rows.append(
-                    {
-                        "symbol": sym,
-                        "timeframe": tf_label,
-                        "last_time": None,
-                        "close": None,
-                        "ema_fast": None,
-                        "ema_slow": None,
-                        "adx": None,
-                        "supertrend": None,
-                        "supertrend_dir": None,
-                        "atr": None,
-                        "tp1": None,
-                        "tp2": None,
-                        "trend": f"ERROR: {e}",
-                        "bars_count": 0,
-                    }
-                )
-
-    return pd.DataFrame(rows)
-
+    """
+    ดึงข้อมูลทุก (symbol, timeframe) พร้อมกัน แล้วคำนวณ indicator ต่อใน thread หลัก
+    (kernel numba ใช้แค่ไมโครวินาทีต่อชุด ส่งเข้า process pool แพงกว่าคำนวณเองมาก)
+    fetch_workers: จำนวน connection/thread สำหรับดึงข้อมูลพร้อมกัน
+    """
+    # ลำดับแถว symbol -> timeframe ตามที่ส่งเข้ามา, แต่ละงานเขียนลงตำแหน่งของตัวเอง
+    index = {
+        (sym, tf_label): i
+        for i, (sym, tf_label) in enumerate(
+            (sym, tf_label) for sym in symbols for tf_label in timeframes_dict
+        )
+    }
+    cols = _alloc_table(len(index))
+    for (sym, tf_label), i in index.items():
+        cols["symbol"][i] = sym
+        cols["timeframe"][i] = tf_label
+
+    frames = {}
+
+    # ดึงข้อมูลพร้อมกัน (งานส่วนนี้รอ network เป็นหลัก)
+    # มี aiohttp -> ยิงทั้งหมดใน event loop เดียว, ไม่มี -> thread pool
+    if aiohttp is not None:
+        keys = list(index)
+        results = asyncio.run(
+            _fetch_all_async([(sym, timeframes_dict[tf_label]) for sym, tf_label in keys], bars, fetch_workers)
+        )
+        for key, res in zip(keys, results):
+            if isinstance(res, Exception):
+                cols["trend"][index[key]] = f"ERROR: {res}"
+            else:
+                frames[key] = res
+    else:
+        with ThreadPoolExecutor(max_workers=fetch_workers) as ex:
+            futures = {
+                ex.submit(fetch_ohlcv, sym, res, bars): (sym, tf_label)
+                for sym in symbols
+                for tf_label, res in timeframes_dict.items()
+            }
+            for fut in as_completed(futures):
+                key = futures[fut]
+                try:
+                    frames[key] = fut.result()
+                except Exception as e:
+                    cols["trend"][index[key]] = f"ERROR: {e}"
+
+    for (sym, tf_label), df in frames.items():
+        try:
+            row = _trend_row(sym, tf_label, df, fast, slow, adx_len, adx_threshold, super_len, super_mult)
+            _fill_row(cols, index[(sym, tf_label)], row)
+        except Exception as e:
+            cols["trend"][index[(sym, tf_label)]] = f"ERROR: {e}"
+
+    return pd.DataFrame(cols, copy=False)
+
+
+if __name__ == "__main__" and "--check-parity" in sys.argv[1:]:
+    # เทียบ kernel กับ pandas_ta บนข้อมูลจริงทุก symbol / timeframe (ต้องติดตั้ง pandas_ta)
+    worst = {}
+    for sym in currency:
+        for res in timeframes.values():
+            for name, diff in check_parity(fetch_ohlcv(sym, res, bars=200)).items():
+                worst[name] = max(worst.get(name, 0.0), diff)
+    for name, diff in worst.items():
+        print(f"{name:<15} max rel diff = {diff:.3e}  {'OK' if diff < 1e-9 else 'MISMATCH'}")
+    sys.exit(0 if all(d < 1e-9 for d in worst.values()) else 1)
 
 if __name__ == "__main__":
     trend_df = build_trend_table(
@@ -295,6 +760,8 @@ if __name__ == "__main__":
         print(f"\n===== {sym} =====\n")
         print_pretty_table(group)
 
+    import psutil
+
     process = psutil.Process(os.getpid())
     memory_used = process.memory_info().rss / (1024 ** 2)  # MB
     print(f"Memory Used: {memory_used:.2f} MB")